@@ -6,20 +6,24 @@ It is intended to run this as a systemd service unit. It is optimized for runnin
 from __future__ import annotations
 
 from contextlib import asynccontextmanager
-from typing import TYPE_CHECKING, Annotated, List, Set, Tuple, cast
+from datetime import datetime  # noqa: TCH003 FastAPI needs this at runtime for parsing
+from enum import Enum
+from typing import TYPE_CHECKING, Annotated, List, Optional, Set, Tuple, Union
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from numpy import uint32
-from numpy.typing import NDArray
+from fastapi.responses import PlainTextResponse
 
 from analysis import definitions, state
 from analysis.app_logging import logger
 from analysis.camera_info import get_sources
 from analysis.read import load_motions
+from analysis.util.metrics import registry
 from analysis.util.tasks import create_task
+from analysis.util.time import get_day_range, localize, today
 from analysis.vision.capture import analyze_sources
-from analysis.vision.motion_search.read import calculate_heatmap, get_motions_in_area
+from analysis.vision.motion_search.read import calculate_heatmap, get_motions_in_range, to_intervals
+from analysis.vision.motion_search.store import CacheInfo  # noqa: TCH001 FastAPI needs this at runtime
 
 if TYPE_CHECKING:
     from cv2.typing import Rect
@@ -31,12 +35,29 @@ SPAN_SIZE_DOC = (
     "'30' would mean that the information will be lossy compressed "
     "(the indices now stand for 30 second time slots). "
     "The maximum return integer would be `24*60*2`. "
+    "Indices are relative to `start`."
 )
+START_DOC = (
+    "Start of the queried time range. Defaults to the start of today. Naive times are interpreted as local time."
+)
+END_DOC = "End of the queried time range (exclusive). Defaults to the end of the day of `start`."
+FORMAT_DOC = (
+    "Format of the returned motion data. "
+    "'set' returns every index with motion. "
+    "'intervals' returns merged `[start, end)` index intervals, which is much smaller for busy cameras."
+)
+
+
+class MotionFormat(str, Enum):
+    """Available response formats for motion data."""
+
+    set = "set"
+    intervals = "intervals"
 
 
 @asynccontextmanager
 async def _main(_: FastAPI):
-    state.motions = load_motions()
+    state.motions = load_motions(read_only=definitions.API_ONLY)
     if not definitions.API_ONLY:
         logger.info("Starting analysis.")
         sources = await get_sources()
@@ -70,9 +91,25 @@ app.add_middleware(
 @app.get("/heatmap")
 def get_heatmap(
     camera_id: Annotated[str, Query(description="Identifier of the camera/source in question.")],
+    start: Annotated[Optional[datetime], Query(description=START_DOC)] = None,  # noqa: UP007
+    end: Annotated[Optional[datetime], Query(description=END_DOC)] = None,  # noqa: UP007
 ) -> List[int] | None:  # noqa: UP006
     """Return a list with number for motion occurrences in every segment."""
-    return calculate_heatmap(camera_id)
+    if start is None and end is None:
+        return calculate_heatmap(camera_id)
+    return calculate_heatmap(camera_id, *_get_time_range(start, end))
+
+
+@app.get("/motion_store/cache")
+def get_motion_store_cache() -> CacheInfo:
+    """Return hit, miss and eviction counters of the motion store shard cache, to tune its memory budget."""
+    return state.motions.cache_info()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Return counters and stage duration histograms of all analysis processes in the Prometheus text format."""
+    return registry.render()
 
 
 @app.get("/motion_data")
@@ -82,23 +119,56 @@ def get_motions_from_percent(  # noqa: PLR0913 we need more params that for API
     top: Annotated[float, Query(description="Top bound for selection rectangle in percent of total height.")],
     width: Annotated[float, Query(description="Width for selection rectangle in percent of total width")],
     height: Annotated[float, Query(description="Height for selection rectangle in percent of total height.")],
-    span_size: Annotated[int, Query(description=SPAN_SIZE_DOC)] = 1,
-) -> Set[int]:  # noqa: UP006
-    """Get motion frames for given image section (in percent)."""
+    span_size: Annotated[int, Query(description=SPAN_SIZE_DOC, gt=0)] = 1,
+    start: Annotated[Optional[datetime], Query(description=START_DOC)] = None,  # noqa: UP007
+    end: Annotated[Optional[datetime], Query(description=END_DOC)] = None,  # noqa: UP007
+    response_format: Annotated[MotionFormat, Query(alias="format", description=FORMAT_DOC)] = MotionFormat.set,
+) -> Union[Set[int], List[Tuple[int, int]]]:  # noqa: UP006, UP007
+    """Get motion frames for given image section (in percent).
+
+    The time range can span multiple days, the result is a single timeline.
+    """
     y = int(top * definitions.GRID_SIZE[0])
     height = int(height * definitions.GRID_SIZE[0]) + 1
     x = int(left * definitions.GRID_SIZE[1])
     width = int(width * definitions.GRID_SIZE[1]) + 1
     logger.debug(f"{x}, {y} - {width}, {height}")
-    return get_motions_from_cells(camera_id, (x, y, width, height), span_size)
-
-
-def get_motions_from_cells(camera_id: str, bounds: Rect, span_size: int = 1):
-    """Get motion frames for given image section (in cells)."""
+    if response_format == MotionFormat.intervals:
+        return get_motion_intervals_from_cells(camera_id, (x, y, width, height), span_size, start, end)
+    return set(get_motions_from_cells(camera_id, (x, y, width, height), span_size, start, end).tolist())
+
+
+def get_motion_intervals_from_cells(
+    camera_id: str,
+    bounds: Rect,
+    span_size: int = 1,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> list[tuple[int, int]]:
+    """Get motion intervals [start, end) for given image section (in cells) and time range."""
+    return to_intervals(get_motions_from_cells(camera_id, bounds, span_size, start, end)).tolist()
+
+
+def get_motions_from_cells(
+    camera_id: str,
+    bounds: Rect,
+    span_size: int = 1,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """Get sorted motion frame indices for given image section (in cells) and time range."""
     (x, y, width, height) = bounds
     if (x + width) > definitions.GRID_SIZE[1] or (y + height) > definitions.GRID_SIZE[0]:
         logger.error(f"{x}, {y} - {width}, {height}")
         raise HTTPException(422, "Requested selection is out of bounds.")
-    merged = get_motions_in_area(state.motions, camera_id, (x, y, width, height))
-    motions = cast(Tuple[NDArray[uint32], NDArray[uint32]], merged.nonzero())[1].tolist()
-    return {int(index / span_size) for index in motions}
+    (start, end) = _get_time_range(start, end)
+    return get_motions_in_range(state.motions, camera_id, (x, y, width, height), start, end, span_size)
+
+
+def _get_time_range(start: datetime | None, end: datetime | None):
+    """Get the queried time range with defaults, in the timezone of the program."""
+    start = localize(start) if start is not None else today()
+    end = localize(end) if end is not None else get_day_range(start)[1]
+    if end <= start:
+        raise HTTPException(422, "The end of the time range must be after its start.")
+    return start, end
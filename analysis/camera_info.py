@@ -7,6 +7,7 @@ from httpx import AsyncClient
 from analysis.definitions import PATH_SETTINGS
 from analysis.types_adeck import parse_all, settings
 from analysis.types_adeck.camera import Camera
+from analysis.vision.analyses import Stream
 from user_secrets import CAMERA_URL, C
 
 client = AsyncClient(verify=C, timeout=5)
@@ -24,9 +25,9 @@ def _is_not_excluded(camera: Camera):
     return camera.uuid not in EXCLUDES
 
 
-def get_rtsp_url(camera: Camera):
-    """Get the RTSP URL for recordings with credentials."""
-    rtsp_url = camera.streams.sd.url
+def get_rtsp_url(camera: Camera, stream: Stream = Stream.sd):
+    """Get the RTSP URL of the given stream with credentials."""
+    rtsp_url = getattr(camera.streams, stream.value).url
     # Add credentials to rtsp_url
     credentials = camera.credentials
     return rtsp_url.replace(
@@ -36,5 +37,7 @@ def get_rtsp_url(camera: Camera):
 
 
 async def get_sources():
-    """Get all cameras from the adeck VMS, mapped by their ID."""
-    return {camera.uuid: get_rtsp_url(camera) for camera in await get_cameras()}
+    """Get the stream URLs of all cameras from the adeck VMS, mapped by their ID."""
+    return {
+        camera.uuid: {stream: get_rtsp_url(camera, stream) for stream in Stream} for camera in await get_cameras()
+    }
@@ -6,11 +6,8 @@ See :module:`state` for runtime variables.
 from __future__ import annotations
 
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict
-
-from scipy.sparse import lil_array
 
 from user_secrets import DATABASE_PATH
 
@@ -21,7 +18,18 @@ API_ONLY = os.getenv("API_ONLY", None) == "True"
 TIMEZONE = datetime.now(timezone.utc).astimezone().tzinfo
 """Timezone that the program runs in."""
 
-PATH_MOTIONS = DATABASE_PATH / "motions.npy"
+PATH_MOTIONS = DATABASE_PATH / "motions"
+"""Path to the directory of the motion store (see :module:`analysis.vision.motion_search.store`)."""
+PATH_MOTIONS_LEGACY = DATABASE_PATH / "motions.npy"
+"""Path to the pickled motion data that was used before the motion store existed."""
+SHARD_CACHE_BUDGET = int(os.getenv("SHARD_CACHE_BUDGET", str(1024**3)))
+"""Memory budget for mapped motion store shards in bytes. The shards of today and yesterday are always kept."""
+CHECKPOINT_INTERVAL = 60
+"""How many seconds to wait between checkpoints of the motion store."""
+RESULT_WINDOW = float(os.getenv("RESULT_WINDOW", "1"))
+"""How many seconds of analysis results a capture process collects, to send them to the parent process at once."""
+PATH_COSTS = DATABASE_PATH / "costs.json"
+"""Path to the measured CPU costs of the sources, see :module:`analysis.vision.scheduler`."""
 PATH_SETTINGS = Path("./settings.toml")
 """Path to the analysis settings TOML file."""
 
@@ -29,5 +37,7 @@ GRID_SIZE = (9, 16)
 """How many rows and columns should exist to define the cells."""
 CELLS = GRID_SIZE[0] * GRID_SIZE[1]
 INTERVAL = 1
-
-MotionData = Dict[str, Dict[str, lil_array]]
+"""Size of a motion time frame in seconds."""
+DAY_IN_SECONDS = int(timedelta(days=1).total_seconds())
+TIMEFRAMES = int(DAY_IN_SECONDS / INTERVAL)
+"""How many motion time frames exist in a day."""
@@ -5,16 +5,30 @@ from rich.console import Console
 
 from analysis import definitions
 from analysis.app_logging import logger
+from analysis.vision.motion_search.store import MotionStore
 
 console = Console()
 
 
-def load_motions() -> definitions.MotionData:
-    """Load the motion store from disk."""
+def load_motions(read_only: bool = False):
+    """Open the motion store on disk.
+
+    This does not read any motion data, that is done lazily when it is accessed.
+    If the store is writable, changes that were not saved yet (for example due to a crash) are recovered.
+    """
+    logger.debug(f"Opening motion store at {definitions.PATH_MOTIONS}.")
+    motions = MotionStore(definitions.PATH_MOTIONS, read_only)
+    if not read_only:
+        motions.recover()
+    return motions
+
+
+def load_legacy_motions():
+    """Load the pickled motion data that was used before the motion store existed."""
     try:
-        logger.debug(f"Loading motion data from {definitions.PATH_MOTIONS}.")
-        with definitions.PATH_MOTIONS.open("rb") as f:
+        logger.debug(f"Loading legacy motion data from {definitions.PATH_MOTIONS_LEGACY}.")
+        with definitions.PATH_MOTIONS_LEGACY.open("rb") as f:
             return load(f, allow_pickle=True).item()
     except FileNotFoundError:
-        logger.info("No saved motion data was found, starting fresh.")
+        logger.info("No legacy motion data was found.")
         return {}
@@ -10,9 +10,10 @@ from asyncio import Event
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from analysis.definitions import MotionData
+    from analysis.vision.motion_search.store import MotionStore
 
 terminating = Event()
 """Flag to quit long running processes."""
 
-motions: MotionData = {}
+motions: MotionStore
+"""Store for motion search data. This is set on startup, see :func:`analysis.read.load_motions`."""
@@ -1,7 +1,8 @@
 """Module that defines the type for program settings."""
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Mapping
+from dataclasses import field
+from typing import TYPE_CHECKING, Any, Literal, Mapping
 
 import rich
 import tomllib
@@ -23,6 +24,8 @@ class Settings(BaseType):
 
     excludes: list[str]
     shelf_monitoring: dict[str, RectPoints]
+    shelf_monitoring_stream: Literal["sd", "hd"] = "sd"
+    motion_engines: dict[str, Literal["diff", "mog2", "knn"]] = field(default_factory=dict)
 
     @staticmethod
     def repr_raw(json: Mapping[str, Any]) -> str:  # noqa: ARG004
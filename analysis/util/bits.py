@@ -0,0 +1,95 @@
+"""Module for working with bit-packed NumPy arrays.
+
+Bits are packed in little endian order, so bit `i` of a row is saved in byte `i // 8` at position `i % 8`.
+See https://numpy.org/doc/stable/reference/generated/numpy.packbits.html
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+BIT_ORDER = "little"
+
+_POPCOUNT = np.array([value.bit_count() for value in range(256)], dtype=np.uint8)
+"""Lookup table for the amount of set bits in every possible byte."""
+
+
+def packed_size(bit_count: int):
+    """Get the amount of bytes that are needed to save the given amount of bits."""
+    return (bit_count + 7) // 8
+
+
+def set_bits(packed: NDArray[np.uint8], rows: NDArray[Any], indices: NDArray[Any]):
+    """Set the bits at the given row and bit indices of a 2D bit-packed array in place.
+
+    Duplicate positions are allowed. A buffered assignment only applies one value for duplicate bytes,
+    so the bits of every byte are combined first (after sorting by byte). That is much faster than `ufunc.at`.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return
+    if (indices == indices[0]).all():
+        # All bits have the same index (like the motion of a single time frame), which is a single assignment
+        set_column(packed, rows, int(indices[0]))
+        return
+    columns = packed.shape[1]
+    keys = rows * columns + (indices >> 3)
+    order = np.argsort(keys)
+    keys = keys[order]
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    masks = np.left_shift(1, indices[order] & 7).astype(np.uint8)
+    byte_rows, byte_columns = np.divmod(keys[starts], columns)
+    packed[byte_rows, byte_columns] |= np.bitwise_or.reduceat(masks, starts)
+
+
+def set_column(packed: NDArray[np.uint8], rows: NDArray[Any], index: int):
+    """Set the bit at the given index in the given rows of a 2D bit-packed array in place."""
+    column = packed[:, index >> 3]
+    column[rows] |= np.uint8(1 << (index & 7))
+
+
+def get_bits(packed: NDArray[np.uint8], rows: NDArray[Any], indices: NDArray[Any]) -> NDArray[np.bool_]:
+    """Get the bits at the given row and bit indices of a 2D bit-packed array."""
+    indices = np.asarray(indices, dtype=np.int64)
+    return ((packed[rows, indices >> 3] >> (indices & 7).astype(np.uint8)) & 1).view(np.bool_)
+
+
+def unpack(packed: NDArray[np.uint8], bit_count: int | None = None) -> NDArray[np.bool_]:
+    """Get a boolean array from the given bit-packed array (along the last axis)."""
+    return np.unpackbits(packed, axis=-1, count=bit_count, bitorder=BIT_ORDER).view(np.bool_)
+
+
+def pack(bits: NDArray[Any]) -> NDArray[np.uint8]:
+    """Get a bit-packed array from the given boolean array (along the last axis)."""
+    return np.packbits(bits, axis=-1, bitorder=BIT_ORDER)
+
+
+def combine_or(packed: NDArray[np.uint8]) -> NDArray[np.uint8]:
+    """Combine all rows of a 2D bit-packed array with or (bitwise)."""
+    return np.bitwise_or.reduce(packed, axis=0)
+
+
+def popcount(packed: NDArray[np.uint8]) -> NDArray[np.int64]:
+    """Get the amount of set bits for every row of a bit-packed array."""
+    return _POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+def popcount_range(packed: NDArray[np.uint8], start: int, stop: int) -> NDArray[np.int64]:
+    """Get the amount of set bits in the bit range [start, stop) for every row of a bit-packed array."""
+    first_full = packed_size(start)
+    last_full = stop // 8
+    if first_full >= last_full:
+        # The range lies inside a single byte or two neighbouring bytes
+        bits = unpack(packed[..., start // 8 : packed_size(stop)])
+        return bits[..., start % 8 : start % 8 + stop - start].sum(axis=-1, dtype=np.int64)
+    counts = popcount(packed[..., first_full:last_full])
+    if start % 8 != 0:
+        counts += unpack(packed[..., start // 8 : first_full])[..., start % 8 :].sum(axis=-1, dtype=np.int64)
+    if stop % 8 != 0:
+        counts += unpack(packed[..., last_full : last_full + 1])[..., : stop % 8].sum(axis=-1, dtype=np.int64)
+    return counts
@@ -0,0 +1,221 @@
+"""Module for handing frames from a video capture to analyses that consume them at their own rate."""
+from __future__ import annotations
+
+from multiprocessing.shared_memory import SharedMemory
+from threading import Condition
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING, Generic, NamedTuple, Protocol, TypeVar
+
+import numpy as np
+
+from analysis.app_logging import logger
+
+if TYPE_CHECKING:
+    from cv2.typing import MatLike
+
+T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+
+RING_SIZE = 8
+"""Amount of frames in a :class:`SharedFrameRing`."""
+POLL_INTERVAL = 0.005
+"""How long a reader of a :class:`SharedFrameRing` waits between checks for a new frame (in seconds)."""
+MAX_CLOCK_AHEAD = 1
+"""How far (in seconds) the time of a frame may be ahead of the time it was read, see :class:`StreamClock`."""
+MAX_CLOCK_BEHIND = 30
+"""How far (in seconds) the time of a frame may be behind the time it was read, see :class:`StreamClock`."""
+
+
+class Frame(NamedTuple):
+    """Image of a video stream with the time it was captured."""
+
+    image: MatLike
+    time: float
+    """UNIX time at which the image was captured, see :class:`StreamClock`."""
+
+
+class StreamClock:
+    """Clock that maps the timestamps of the frames of a stream (their PTS) to UNIX time.
+
+    The stream time is anchored to the wall clock by the first frame with a timestamp. Later frames get the time
+    of the stream, so their time is right even if they are read late (for example when decoding falls behind).
+    The clock is anchored again when a timestamp jumps, for example after the stream was reopened.
+    Frames of streams without timestamps get the time they are read.
+    """
+
+    def __init__(self) -> None:
+        """Create a clock that is anchored by the next frame."""
+        self._offset: float | None = None
+
+    def get_time(self, position: float):
+        """Get the UNIX time of the frame at the given stream position (in milliseconds)."""
+        now = time()
+        if position <= 0:
+            return now
+        stream_time = position / 1000
+        if self._offset is None or not -MAX_CLOCK_BEHIND <= self._offset + stream_time - now <= MAX_CLOCK_AHEAD:
+            self._offset = now - stream_time
+        return min(self._offset + stream_time, now)
+
+
+class FrameSource(Protocol[T_co]):
+    """Source of the latest frames of a stream, see :class:`LatestFrame` and :class:`SharedFrameRing`."""
+
+    @property
+    def closed(self) -> bool:
+        """Whether the stream has ended."""
+        ...
+
+    def get(self, after: int = 0, timeout: float | None = None) -> tuple[int, T_co] | None:
+        """Wait for a frame that is newer than the given sequence number."""
+        ...
+
+
+class LatestFrame(Generic[T]):
+    """Thread-safe slot that only holds the most recent frame of a stream (latest frame wins).
+
+    Writing never blocks, so the reading thread can always keep up with the stream.
+    A frame that was not taken before the next one arrives is replaced.
+    Every frame gets a sequence number, so readers can detect which frames they have missed.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty slot."""
+        self._condition = Condition()
+        self._frame: T | None = None
+        self._sequence = 0
+        self._closed = False
+
+    @property
+    def closed(self):
+        """Whether the stream has ended. No new frames will arrive then."""
+        return self._closed
+
+    def put(self, frame: T):
+        """Replace the held frame with the given one and wake up all waiting readers."""
+        with self._condition:
+            self._frame = frame
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def close(self):
+        """Mark the end of the stream and wake up all waiting readers."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get(self, after: int = 0, timeout: float | None = None) -> tuple[int, T] | None:
+        """Wait for a frame that is newer than the given sequence number.
+
+        :param after: Sequence number of the last frame that the reader has taken.
+        :return: The sequence number and the frame. None if the stream has ended or the timeout has passed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._sequence > after or self._closed, timeout):
+                return None
+            if self._sequence <= after or self._frame is None:
+                return None
+            return self._sequence, self._frame
+
+
+class SharedFrameRing:
+    """Ring buffer of frames in shared memory, that other processes can attach to (latest frame wins).
+
+    This provides the same interface as :class:`LatestFrame`, so analyses can be run in separate processes.
+    Frames are written into the slots in turn and readers get a view of the slot with the latest frame,
+    so frames are neither pickled nor copied between processes. A view stays valid until the writer
+    comes around to its slot again, which is after :const:`RING_SIZE` frames. Readers that may take longer
+    check with :meth:`is_intact` whether the frame was overwritten while they processed it.
+
+    The shared memory starts with a header of 64 bit integers:
+    sequence number of the latest frame, closed flag and the sequence number of the frame in every slot.
+    It is followed by the capture time (64 bit float) of the frame in every slot.
+    """
+
+    def __init__(self, shape: tuple[int, ...], name: str | None = None, size: int = RING_SIZE) -> None:
+        """Create a ring for frames of the given shape, or attach to an existing one if a name is given."""
+        self.shape = shape
+        self.size = size
+        header_size = (2 + size) * np.dtype(np.int64).itemsize
+        times_size = size * np.dtype(np.float64).itemsize
+        frames_size = size * int(np.prod(shape))
+        self._memory = SharedMemory(name, create=name is None, size=header_size + times_size + frames_size)
+        self._header = np.ndarray((2 + size,), dtype=np.int64, buffer=self._memory.buf)
+        self._times = np.ndarray((size,), dtype=np.float64, buffer=self._memory.buf, offset=header_size)
+        self._frames = np.ndarray(
+            (size, *shape),
+            dtype=np.uint8,
+            buffer=self._memory.buf,
+            offset=header_size + times_size,
+        )
+        if name is None:
+            self._header[:] = 0
+        # Slot and sequence number of the frame that this reader has taken last
+        self._taken: tuple[int, int] | None = None
+
+    @property
+    def name(self):
+        """Name of the shared memory, to attach to this ring from other processes."""
+        return self._memory.name
+
+    @property
+    def closed(self):
+        """Whether the stream has ended. No new frames will arrive then."""
+        return bool(self._header[1])
+
+    def put(self, frame: Frame):
+        """Write the given frame into the next slot. Only a single process may write."""
+        if frame.image.shape != self.shape:
+            logger.error(f"Skipping frame with shape {frame.image.shape}, the frame ring is set up for {self.shape}.")
+            return
+        sequence = int(self._header[0]) + 1
+        index = sequence % self.size
+        # Invalidate the slot while it is written, so readers do not take a partially written frame
+        self._header[2 + index] = 0
+        self._frames[index] = frame.image
+        self._times[index] = frame.time
+        self._header[2 + index] = sequence
+        self._header[0] = sequence
+
+    def close(self):
+        """Mark the end of the stream."""
+        self._header[1] = 1
+
+    def get(self, after: int = 0, timeout: float | None = None) -> tuple[int, Frame] | None:
+        """Wait for a frame that is newer than the given sequence number.
+
+        As there is no notification between processes, this polls the latest sequence number.
+        :param after: Sequence number of the last frame that the reader has taken.
+        :return: The sequence number and a read-only view of the frame.
+        None if the stream has ended or the timeout has passed.
+        """
+        deadline = monotonic() + timeout if timeout is not None else None
+        while True:
+            sequence = int(self._header[0])
+            index = sequence % self.size
+            if sequence > after and self._header[2 + index] == sequence:
+                image = self._frames[index]
+                image.flags.writeable = False
+                self._taken = (index, sequence)
+                return sequence, Frame(image, float(self._times[index]))
+            if self.closed or (deadline is not None and monotonic() >= deadline):
+                return None
+            sleep(POLL_INTERVAL)
+
+    def is_intact(self):
+        """Check whether the frame that was taken last is still in its slot, so its view was not overwritten."""
+        if self._taken is None:
+            return True
+        index, sequence = self._taken
+        return int(self._header[2 + index]) == sequence
+
+    def release(self, unlink: bool = False):
+        """Detach from the shared memory. The creating process should also unlink it, after all readers are done."""
+        # Views into the buffer have to be deleted before it can be closed
+        del self._header, self._times, self._frames
+        try:
+            self._memory.close()
+        except BufferError:
+            logger.debug("Frames of the frame ring are still referenced, it is detached on process exit.")
+        if unlink:
+            self._memory.unlink()
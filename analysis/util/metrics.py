@@ -0,0 +1,162 @@
+"""Module for lightweight runtime metrics (counters and histogram timers).
+
+Metrics are recorded in the registry of the process that produces them.
+Worker processes send snapshots of their registry to the parent process (see :module:`analysis.vision.transport`),
+where they are combined and exposed in the Prometheus text format.
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+
+Recording a value takes a lock and a few arithmetic operations (about a microsecond),
+so this can be used on hot paths.
+"""
+from __future__ import annotations
+
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, TypeVar
+
+if TYPE_CHECKING:
+    from types import TracebackType
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""Upper bounds of the histogram buckets in seconds. Values above the last bound are only counted in `+Inf`."""
+STAGE_METRIC = "analysis_stage_seconds"
+"""Name of the histogram for the duration of processing stages (for example decoding), by source and stage."""
+LAG_METRIC = "analysis_lag_seconds"
+"""Name of the histogram for the time from the capture of a frame to the collection of its result.
+
+It is labeled by source and analysis, so its count is the amount of results of an analysis for a source.
+"""
+
+Labels = tuple[tuple[str, str], ...]
+Key = tuple[str, Labels]
+Snapshot = tuple[dict[Key, float], dict[Key, tuple[list[int], float]]]
+"""Counter values and histograms (bucket counts and sum) of a registry."""
+
+
+class Registry:
+    """Thread-safe collection of counters and histograms, identified by name and labels."""
+
+    def __init__(self) -> None:
+        """Create an empty registry."""
+        self._lock = Lock()
+        self._counters: dict[Key, float] = {}
+        self._histograms: dict[Key, tuple[list[int], float]] = {}
+        self._remote: dict[str, Snapshot] = {}
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        """Increase the counter with the given name and labels."""
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Record a value (in seconds) in the histogram with the given name and labels."""
+        key = (name, tuple(labels.items()))
+        index = bisect_left(BUCKETS, value)
+        with self._lock:
+            counts, total = self._histograms.get(key) or ([0] * (len(BUCKETS) + 1), 0.0)
+            counts[index] += 1
+            self._histograms[key] = (counts, total + value)
+
+    def snapshot(self) -> Snapshot:
+        """Get a copy of all metrics that were recorded in this process."""
+        with self._lock:
+            histograms = {key: (counts.copy(), total) for key, (counts, total) in self._histograms.items()}
+            return self._counters.copy(), histograms
+
+    def clear(self):
+        """Remove all metrics, for example the ones that a forked process has copied from its parent."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._remote.clear()
+
+    def update_remote(self, origin: str, snapshot: Snapshot):
+        """Replace the metrics of another process with the given snapshot."""
+        with self._lock:
+            self._remote[origin] = snapshot
+
+    def render(self):
+        """Get the metrics of this and all other processes in the Prometheus text format."""
+        counters, histograms = self.snapshot()
+        with self._lock:
+            remote = list(self._remote.values())
+        for remote_counters, remote_histograms in remote:
+            for key, value in remote_counters.items():
+                counters[key] = counters.get(key, 0) + value
+            for key, (counts, total) in remote_histograms.items():
+                previous_counts, previous_total = histograms.get(key) or ([0] * len(counts), 0.0)
+                summed = [a + b for a, b in zip(previous_counts, counts, strict=True)]
+                histograms[key] = (summed, previous_total + total)
+
+        lines: list[str] = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(
+                f"{name}{_format_labels(labels)} {value}" for (key, labels), value in counters.items() if key == name
+            )
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (key, labels), (counts, total) in histograms.items():
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), counts, strict=True):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels((*labels, ('le', str(bound))))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+class timer:  # noqa: N801 used like a function
+    """Context manager that records its duration in a histogram of the module level registry."""
+
+    def __init__(self, name: str, **labels: str) -> None:
+        """Create a timer for the histogram with the given name and labels."""
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> None:
+        """Start the timer."""
+        self._start = perf_counter()
+
+    def __exit__(
+        self,
+        exception_type: type[BaseException] | None,
+        exception: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Record the elapsed time."""
+        registry.observe(self.name, perf_counter() - self._start, **self.labels)
+
+
+def timed(function: Callable[[T], R], name: str, **labels: str) -> Callable[[T], R]:
+    """Wrap the given function, so that the duration of every call is recorded."""
+
+    def timed_function(value: T):
+        start = perf_counter()
+        result = function(value)
+        registry.observe(name, perf_counter() - start, **labels)
+        return result
+
+    return timed_function
+
+
+def _format_labels(labels: Labels):
+    if len(labels) == 0:
+        return ""
+    formatted = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{{{formatted}}}"
+
+
+def _escape(value: object):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Registry()
+"""Metrics of this process."""
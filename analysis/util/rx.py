@@ -3,33 +3,118 @@ from __future__ import annotations
 
 from concurrent.futures import ThreadPoolExecutor
 from threading import Event
-from typing import TYPE_CHECKING
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Callable, Iterator, TypeVar
 
+import cv2
 from reactivex import Observable, create
 from reactivex.disposable import Disposable
 
 from analysis.app_logging import logger
+from analysis.util.frames import Frame, StreamClock
+from analysis.util.metrics import STAGE_METRIC, registry, timer
 
 if TYPE_CHECKING:
-    import cv2
-    from cv2.typing import MatLike
     from reactivex.abc import ObserverBase, SchedulerBase
 
+    from analysis.util.frames import FrameSource
+
+T = TypeVar("T")
 
 executor = ThreadPoolExecutor(None, "Capture")
 
+DEFAULT_STREAM_FPS = 25
+"""Frame rate that is assumed if the stream does not report a plausible one. This is the rate of the used IP cameras."""
+MAX_STREAM_FPS = 120
+THROTTLE_TOLERANCE = 0.8
+"""Share of its time per frame that an analysis should throttle with.
 
-def from_capture(capture: cv2.VideoCapture, termination_event: Event) -> Observable[MatLike]:
-    """Create an observable from an opencv capture."""
+The capture already decodes at about the needed frame rate (see :func:`read_frames`), so this tolerates jitter.
+"""
+DROP_REPORT_INTERVAL = 60
+"""How often to report frames that were dropped by :func:`from_slot` (in seconds)."""
 
-    def on_subscribe(observer: ObserverBase[MatLike], _: SchedulerBase | None):
-        disposed = Event()
-        while capture.isOpened() and not termination_event.is_set() and not disposed.is_set():
-            success, frame = capture.read()
-            if not success:
-                logger.error("Observable OpenCV Capture was not successful.")
+
+def get_stream_fps(capture: cv2.VideoCapture):
+    """Get the frame rate of the given capture. Some RTSP streams report implausible values, these are replaced."""
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    return fps if 1 <= fps <= MAX_STREAM_FPS else DEFAULT_STREAM_FPS
+
+
+def sample(stream_fps: float, fps: float | None) -> Iterator[bool]:
+    """Yield for every frame of a stream whether it is needed to reach the given frame rate.
+
+    :param fps: The needed frame rate. None means that every frame is needed.
+    """
+    step = max(stream_fps / fps, 1) if fps is not None else 1
+    next_index = 0.0
+    index = 0
+    while True:
+        needed = index >= next_index
+        if needed:
+            next_index += step
+        index += 1
+        yield needed
+
+
+def read_frames(  # noqa: PLR0913 all parameters are options of the capture
+    capture: cv2.VideoCapture,
+    on_frame: Callable[[Frame], None],
+    should_stop: Callable[[], bool],
+    fps: float | None = None,
+    stall_timeout: float | None = None,
+    source_id: str = "",
+):
+    """Read frames from an opencv capture until the stream ends, fails, stalls or reading should stop.
+
+    Every frame gets the time it was captured, from its timestamp in the stream (see :class:`StreamClock`).
+    :param fps: Highest frame rate that is needed. Only these frames are decoded and passed to `on_frame`,
+    the frames in between are grabbed (to keep up with the stream) but skipped.
+    See https://docs.opencv.org/4.x/d8/dfe/classcv_1_1VideoCapture.html#ae38c2a053d39d6b20c9c649e08ff0146
+    :param stall_timeout: How long (in seconds) the timestamp of the frames may stay the same,
+    for example when a stream freezes but still returns the last frame. None disables the check.
+    Streams without timestamps are never considered stalled.
+    :param source_id: ID of the source for the decoding metrics.
+    """
+    sampling = sample(get_stream_fps(capture), fps)
+    clock = StreamClock()
+    position, changed, has_timestamps = capture.get(cv2.CAP_PROP_POS_MSEC), monotonic(), False
+    while capture.isOpened() and not should_stop():
+        if not capture.grab():
+            logger.error("OpenCV Capture was not successful.")
+            break
+        new_position = capture.get(cv2.CAP_PROP_POS_MSEC)
+        if stall_timeout is not None:
+            now = monotonic()
+            if new_position != position:
+                changed, has_timestamps = now, True
+            elif has_timestamps and now - changed > stall_timeout:
+                logger.error(f"OpenCV Capture is stalled, the frame timestamp did not change for {stall_timeout}s.")
                 break
-            observer.on_next(frame)
+        position = new_position
+        if not next(sampling):
+            continue
+        with timer(STAGE_METRIC, source=source_id, stage="decode"):
+            success, image = capture.retrieve()
+        if not success:
+            logger.error("OpenCV Capture could not decode a frame.")
+            break
+        on_frame(Frame(image, clock.get_time(position)))
+
+
+def from_capture(
+    capture: cv2.VideoCapture,
+    termination_event: Event,
+    fps: float | None = None,
+) -> Observable[Frame]:
+    """Create an observable of the frames of an opencv capture.
+
+    :param fps: Highest frame rate that is needed by the subscribers (see :func:`read_frames`).
+    """
+
+    def on_subscribe(observer: ObserverBase[Frame], _: SchedulerBase | None):
+        disposed = Event()
+        read_frames(capture, observer.on_next, lambda: termination_event.is_set() or disposed.is_set(), fps)
         capture.release()
         observer.on_completed()
 
@@ -39,3 +124,83 @@ def from_capture(capture: cv2.VideoCapture, termination_event: Event) -> Observa
         return Disposable(dispose)
 
     return create(on_subscribe)
+
+
+class _DropReport:
+    """Counter of the frames that a subscriber dropped, which is reported periodically."""
+
+    def __init__(self, name: str, labels: dict[str, str] | None) -> None:
+        """Create a report for the subscriber with the given name and metric labels."""
+        self.name = name
+        self.labels = labels or {}
+        self.dropped = 0
+        self.next_report = monotonic() + DROP_REPORT_INTERVAL
+
+    def report(self):
+        """Log and count the dropped frames, if the report interval has passed."""
+        if (now := monotonic()) < self.next_report:
+            return
+        registry.increment("analysis_dropped_frames_total", self.dropped, **self.labels)
+        if self.dropped > 0:
+            logger.warning(f"{self.name} dropped {self.dropped} frames in {DROP_REPORT_INTERVAL}s, as it is too slow.")
+        self.dropped = 0
+        self.next_report = now + DROP_REPORT_INTERVAL
+
+
+def from_slot(  # noqa: PLR0913 all parameters are options of the subscription
+    slot: FrameSource[T],
+    termination_event: Event,
+    fps: float | None = None,
+    name: str = "Analysis",
+    labels: dict[str, str] | None = None,
+    gate: Callable[[], bool] | None = None,
+) -> Observable[T]:
+    """Create an observable that takes the latest frames from the given slot, at the given rate.
+
+    Frames are taken on the subscribing thread, so a slow subscriber only delays itself and never the capture.
+    Frames that arrive while the subscriber is busy are dropped, the amount is logged periodically.
+    Use `subscribe_on` to run every subscriber on its own thread.
+    :param fps: Rate to take frames with. None means every frame that the subscriber can keep up with.
+    :param name: Name of the subscriber for the log.
+    :param labels: Labels for the metric of dropped frames.
+    :param gate: Check whether the next frame is needed. Frames are skipped (not dropped) while it is closed.
+    """
+    interval = 1 / fps if fps is not None else 0
+
+    def on_subscribe(observer: ObserverBase[T], _: SchedulerBase | None):
+        disposed = Event()
+        sequence = 0
+        drops = _DropReport(name, labels)
+        next_time = monotonic()
+        while not termination_event.is_set() and not disposed.is_set():
+            delay = next_time - monotonic()
+            if delay > 0:
+                sleep(delay)
+            elif fps is not None:
+                # Time frames that have passed while the subscriber was busy
+                missed = int(-delay / interval)
+                drops.dropped += missed
+                next_time += missed * interval
+            item = slot.get(sequence, timeout=1)
+            if item is None:
+                if slot.closed:
+                    break
+                # The stream is paused (for example while it is not needed), so no frames are dropped
+                next_time = monotonic()
+                continue
+            if fps is None and sequence != 0:
+                drops.dropped += item[0] - sequence - 1
+            sequence, frame = item
+            next_time += interval
+            if gate is not None and not gate():
+                continue
+            drops.report()
+            observer.on_next(frame)
+        observer.on_completed()
+
+        def dispose():
+            disposed.set()
+
+        return Disposable(dispose)
+
+    return create(on_subscribe)
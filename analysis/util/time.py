@@ -1,5 +1,5 @@
 """Module for defining common time functions."""
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from analysis.definitions import TIMEZONE
 
@@ -18,6 +18,19 @@ def today():
     return get_date_floored(datetime.now(TIMEZONE))
 
 
+def localize(time: datetime):
+    """Get the given time in the timezone of the program. Naive times are interpreted as local time."""
+    if time.tzinfo is None:
+        return time.replace(tzinfo=TIMEZONE)
+    return time.astimezone(TIMEZONE)
+
+
+def get_day_range(time: datetime):
+    """Get the start of the day of the given time and the start of the following day."""
+    start = get_date_floored(time)
+    return start, start + timedelta(days=1)
+
+
 def seconds_since_midnight(time: datetime):
     """See https://stackoverflow.com/questions/15971308/get-seconds-since-midnight-in-python."""
     return int((time - get_date_floored(time)).seconds)
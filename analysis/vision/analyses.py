@@ -5,18 +5,43 @@ This provides a central place for all analysis definitions.
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Callable, Generic, TypeVar
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Callable, Generic, Sequence, TypeVar
 
-from analysis.vision.motion_search.motion import analyze_motion, update_global_matrix, write_motion
-from analysis.vision.shelf_monitoring.gaps import analyze_shelf, parse_shelf_result
+import numpy as np
+
+from analysis.vision.motion_search import motion
+from analysis.vision.motion_search.motion import (
+    analyze_motion,
+    pack_changes,
+    unpack_changes,
+    update_global_matrices,
+    update_global_matrix,
+    write_motion,
+)
+from analysis.vision.shelf_monitoring import gaps
+from analysis.vision.shelf_monitoring.gaps import analyze_shelf, get_shelf_cells, is_monitored, parse_shelf_result
 
 if TYPE_CHECKING:
-    from cv2.typing import MatLike
+    from datetime import datetime
+
+    from numpy.typing import NDArray
     from reactivex import Observable
 
+    from analysis.util.frames import Frame
+
 T = TypeVar("T")
 
 
+class Stream(str, Enum):
+    """Streams that cameras provide of the same view, in different resolutions."""
+
+    sd = "sd"
+    """Stream with a low resolution, that is captured continuously."""
+    hd = "hd"
+    """Stream with a high resolution, that is only captured while an analysis needs its frames."""
+
+
 @dataclass
 class Analysis(Generic[T]):
     """Class that describes a analysis definition.
@@ -24,21 +49,97 @@ class Analysis(Generic[T]):
     That definition formulates how video feeds should be analyzed with callbacks.
     """
 
-    analyze: Callable[[Observable[MatLike], str, bool], Observable[T] | None]
+    analyze: Callable[[Observable[Frame], str, bool], Observable[tuple[T, float]] | None]
     """Analyze the given frame observable in some way.
 
     This logic will be run in a child process.
+    Every result is emitted with the capture time of its frame (see :attr:`Frame.time`),
+    so it is saved for the right time, no matter how long it takes to reach the parent process.
     Analysis results will be streamed to the main thread to be parsed.
     """
     parse: Callable[[T, str], None]
     """Parse the results of the analysis done by `analyze`."""
     on_termination: Callable[[], None] | None = None
     """Do something before the program shuts down, for example saving to disk."""
+    fps: float | None = None
+    """Highest frame rate that this analysis needs. None means every frame of the stream.
+
+    The capture only decodes frames for the highest rate that any analysis of a source needs.
+    """
+    stream: Stream = Stream.sd
+    """Stream of the source that this analysis takes its frames from.
+
+    The HD stream is only opened while an analysis needs it, that is while the gate of any analysis
+    that uses it is open (see `get_gate_cells`). Sources without an HD stream provide the SD stream instead.
+    If the HD stream of a source can not be opened, the analysis is not run for it (until the analysis restarts),
+    as its settings can be in pixels of the HD frames.
+    """
+    resolution: tuple[int, int] | None = None
+    """Size (width, height) that the frames are scaled to before they are analyzed. None means the stream size.
+
+    Frames are only scaled when the analysis takes them, on its own thread.
+    """
+    isolated: bool = False
+    """Whether to run this analysis in its own process, instead of the capture process of the source.
+
+    Frames are shared with that process without copying (see :class:`analysis.util.frames.SharedFrameRing`).
+    This suits analyses that are CPU heavy, so they do not compete with decoding and other analyses for the GIL.
+    """
+    cost: float = 0.05
+    """Estimated amount of CPU cores that this analysis needs for a source, until the source is measured.
+
+    This is used to distribute sources to processes, see :module:`analysis.vision.scheduler`.
+    """
+    is_used: Callable[[str], bool] | None = None
+    """Check whether this analysis is used for the source with the given ID. None means for every source."""
+    get_motion: Callable[[T], NDArray[Any]] | None = None
+    """Get the grid cells with motion (a mask with the grid size) from a result of this analysis.
+
+    This is recorded for gating other analyses of the source, see `get_gate_cells`.
+    """
+    get_gate_cells: Callable[[str, tuple[int, int]], NDArray[np.bool_] | None] | None = None
+    """Get the grid cells in which motion has to happen for this analysis to run, for a source.
+
+    It gets the ID of the source and the size of its frames (height, width). None means that it always runs.
+    Without motion, the analysis is run at a slow rate, see :module:`analysis.vision.motion_search.activity`.
+    """
+    parse_batch: Callable[[Sequence[tuple[T, str, datetime]]], None] | None = None
+    """Parse a batch of results, each with the ID of its source and the capture time of its frame.
+
+    Used instead of `parse` if given. The results of all sources are collected on a single thread,
+    so this can save per-result overhead.
+    """
+    pack: Callable[[Sequence[T]], bytes] | None = None
+    """Encode a batch of results into a compact binary representation for the transport to the parent process.
+
+    Results are pickled if not given. See :module:`analysis.vision.transport`.
+    """
+    unpack: Callable[[bytes], Sequence[T]] | None = None
+    """Decode a batch of results that was encoded with `pack`."""
 
 
 analyses = {
-    "motion_search": Analysis(analyze_motion, update_global_matrix, write_motion),
-    "shelf_monitoring": Analysis(analyze_shelf, parse_shelf_result),
+    "motion_search": Analysis(
+        analyze_motion,
+        update_global_matrix,
+        write_motion,
+        fps=motion.FPS,
+        resolution=motion.RESOLUTION,
+        parse_batch=update_global_matrices,
+        pack=pack_changes,
+        unpack=unpack_changes,
+        get_motion=np.asarray,
+    ),
+    "shelf_monitoring": Analysis(
+        analyze_shelf,
+        parse_shelf_result,
+        fps=1 / gaps.TIME_PER_FRAME,
+        stream=Stream(gaps.monitoring_stream),
+        isolated=True,
+        cost=0.5,
+        is_used=is_monitored,
+        get_gate_cells=get_shelf_cells,
+    ),
 }
 """Dictionary for the definition of to be done analyses.
 
@@ -7,66 +7,165 @@ from __future__ import annotations
 import signal
 from asyncio import gather, get_event_loop, wait_for
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from multiprocessing import Manager, Pipe
-from typing import TYPE_CHECKING, Any, TypedDict
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import Manager, Pipe, get_context
+from multiprocessing.connection import wait
+from threading import Event, Lock, Thread, get_ident
+from time import clock_gettime, monotonic, process_time, pthread_getcpuclockid, sleep, time
+from typing import TYPE_CHECKING, Any, Callable, MutableMapping, ParamSpec, TypedDict, TypeVar
 
 import cv2
-from cv2 import (
-    VideoCapture,
-)
-from cv2.typing import MatLike
-from reactivex import merge
+from reactivex import create, merge
 from reactivex import operators as ops
 from reactivex.scheduler import ThreadPoolScheduler
 from reactivex.subject import Subject
 
 from analysis import definitions, state
 from analysis.app_logging import logger
-from analysis.util.rx import from_capture
+from analysis.util.frames import Frame, LatestFrame, SharedFrameRing
+from analysis.util.metrics import LAG_METRIC, registry, timer
+from analysis.util.rx import from_slot
 from analysis.util.tasks import create_task
-from analysis.vision.analyses import Analysis, analyses
+from analysis.vision.analyses import Analysis, Stream, analyses
+from analysis.vision.motion_search.activity import MotionActivity, create_gate
+from analysis.vision.scheduler import get_isolated_key, load_costs, save_costs, schedule
+from analysis.vision.supervisor import CaptureSupervisor, open_capture
+from analysis.vision.transport import METRICS, ResultSender, decode
 
 if TYPE_CHECKING:
     import threading
     from multiprocessing.connection import Connection
-    from threading import Event
+    from multiprocessing.process import BaseProcess
+    from pathlib import Path
+
+    from reactivex import Observable
+
+T = TypeVar("T")
+P = ParamSpec("P")
 
 loop = get_event_loop()
 
+FINISH_TIMEOUT = 10
+"""How long to wait for the analyses of a source to finish their last frames after the capture has ended."""
+MAX_BATCH_SIZE = 10
+"""Highest amount of messages to receive from a single connection at once, so no source can block the others."""
+READY_TIMEOUT = 60
+"""How long to wait for an isolated analysis to be set up (for example to load a model)."""
+HD_IDLE_TIMEOUT = 10
+"""How long to keep the HD stream of a source open after the last analysis stopped needing it (in seconds)."""
+DEMAND_INTERVAL = 0.2
+"""How often to check whether an analysis needs the HD stream of a source while it is closed (in seconds)."""
+
 
 subjects: set[Subject[Any]] = set()
-thread_executor = ThreadPoolExecutor(256, "ParseThread")
-process_executor = ProcessPoolExecutor(60)
+thread_executor = ThreadPoolExecutor(1, "ResultCollector")
+spawn = get_context("spawn")
 scheduler = ThreadPoolScheduler(256)
 
 
 class _CaptureParameters(TypedDict):
     source: str
+    source_hd: str | None
     source_id: str
     visualize: bool
-    event: Event
+    event: threading.Event
     analyses: dict[str, Analysis[Any]]
     input_connection: Connection
+    costs: MutableMapping[str, float]
+    """Measured CPU costs (in cores), shared with the parent process, see :module:`analysis.vision.scheduler`."""
+
+
+class _CpuMeter:
+    """Meter of the CPU time that the threads of a source use, which can be read while they are still running.
+
+    The work of a source runs on threads that are shared with other sources (like those of the :attr:`scheduler`),
+    so only the time within :meth:`measure` is counted, by the CPU clock of the thread.
+    """
 
+    def __init__(self) -> None:
+        """Create a meter that measures from now on."""
+        self._lock = Lock()
+        self._start = monotonic()
+        self._finished = 0.0
+        self._running: dict[object, tuple[int, float]] = {}
 
-async def analyze_sources(sources: dict[str, str], display: str | None = None):
+    @contextmanager
+    def measure(self):
+        """Measure the CPU time of the current thread within this context."""
+        clock = pthread_getcpuclockid(get_ident())
+        key = object()
+        with self._lock:
+            self._running[key] = (clock, clock_gettime(clock))
+        try:
+            yield
+        finally:
+            with self._lock:
+                _, start = self._running.pop(key)
+                self._finished += clock_gettime(clock) - start
+
+    def run(self, target: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """Run the given function with the given arguments on the current thread and measure it."""
+        with self.measure():
+            return target(*args, **kwargs)
+
+    def wrap(self, observable: Observable[T]) -> Observable[T]:
+        """Measure the subscriptions to the given observable, which emits on the subscribing thread."""
+        return create(lambda observer, _: self.run(observable.subscribe, observer))
+
+    def get_cores(self):
+        """Get the average amount of CPU cores that the measured threads used since the meter was created."""
+        with self._lock:
+            used = self._finished + sum(clock_gettime(clock) - start for clock, start in self._running.values())
+        return used / max(monotonic() - self._start, 1)
+
+
+async def analyze_sources(
+    sources: dict[str, str | dict[Stream, str]],
+    display: str | None = None,
+    costs_path: Path = definitions.PATH_COSTS,
+    cores: float | None = None,
+):
     """Run analysis for all given sources until termination event. Save results after termination.
 
-    :param sources: Dictionary that lists the sources as values.
+    The sources are distributed to worker processes by their CPU cost (see :module:`analysis.vision.scheduler`).
+    Sources that would saturate this machine are not analyzed.
+    :param sources: Dictionary that lists the sources as values, either as a single URL
+    or as the URLs of the streams of a camera (see :attr:`Analysis.stream`).
     The keys should be unique identifiers for thes URLs as the analysis results will be saved
     with these keys as IDs.
     :param display: ID for a specific source. When given, the corresponding analysis will be visualized.
+    :param costs_path: File to load the measured costs of the sources from and to save them to.
+    :param cores: Amount of CPU cores to admit sources for, see :func:`analysis.vision.scheduler.schedule`.
     """
+    costs = load_costs(costs_path)
+    plan = schedule(list(sources), analyses, costs, cores)
+    for source_id in plan.rejected:
+        logger.error(f'Not analyzing source "{source_id}", as this machine would be saturated by it.')
+    logger.info(f"Analyzing {len(plan.costs)} sources in {len(plan.workers)} processes.")
+    process_executor = ProcessPoolExecutor(max(len(plan.workers), 1))
+    # The collector can not be restarted after it is stopped, so every analysis has its own
+    collector = _ResultCollector()
     with Manager() as manager:
         event = manager.Event()
+        # Filled by the workers when their captures end, before they wait for the analyses to finish
+        measured = manager.dict()
+        collect_future = loop.run_in_executor(thread_executor, collector.run)
         tasks = [
             create_task(
-                _analyze_source(source, source_id, source_id == display, event),
-                source_id,
+                _analyze_worker(
+                    {source_id: sources[source_id] for source_id in worker.sources},
+                    display,
+                    event,
+                    measured,
+                    process_executor,
+                    collector,
+                ),
+                f"Worker {index}",
                 logger,
                 print_exceptions=True,
             )
-            for source_id, source in sources.items()
+            for index, worker in enumerate(plan.workers)
         ]
         logger.info("Analysis is running.")
         await state.terminating.wait()
@@ -80,6 +179,9 @@ async def analyze_sources(sources: dict[str, str], display: str | None = None):
             for task in tasks:
                 if not task.done():
                     task.cancel()
+        save_costs(costs, dict(measured), costs_path)
+        collector.stop()
+        await collect_future
         logger.info("All analysis processes terminated.")
         # Run all on_termination callbacks defined by the analyses
         callbacks = [callback for analysis in analyses.values() if (callback := analysis.on_termination) is not None]
@@ -87,47 +189,162 @@ async def analyze_sources(sources: dict[str, str], display: str | None = None):
             termination_callback()
 
 
-async def _analyze_source(source: str, source_id: str, visualize: bool, event: threading.Event):
-    """Analyze the given source.
+async def _analyze_worker(  # noqa: PLR0913 all parameters are needed for the worker
+    sources: dict[str, str | dict[Stream, str]],
+    display: str | None,
+    event: threading.Event,
+    costs: MutableMapping[str, float],
+    executor: ProcessPoolExecutor,
+    collector: _ResultCollector,
+):
+    """Analyze the given sources in a worker process of the given executor.
 
-    This will start a analysis process and a result parsing thread using the module level executors.
+    The results of every source are sent over a connection of its own and parsed by the given collector.
+    The measured CPU costs are added to the given shared mapping.
     """
-    output_connection, input_connection = Pipe()
-    params = _CaptureParameters(
-        source=source,
-        source_id=source_id,
-        visualize=visualize,
-        event=event,
-        analyses=analyses,
-        input_connection=input_connection,
-    )
-    # Run capture in multiple processes in background (via asyncio task)
-    capture_future = loop.run_in_executor(
-        process_executor,
-        _capture,
-        params,
-    )
-    # Run parsing in multiple threads in foreground
-    parse_future = loop.run_in_executor(
-        thread_executor,
-        _parse,
-        output_connection,
-        source_id,
-    )
-    capture_task = create_task(
-        wait_for(capture_future, timeout=None),
-        f'Capture and analysis task for source "{source}"',
-        logger,
-        print_exceptions=True,
-    )
-    parse_task = create_task(
-        wait_for(parse_future, timeout=None),
-        f'Capture and analysis task for source "{source}"',
-        logger,
-        print_exceptions=True,
-    )
-    await capture_task
-    await parse_task
+    connections: list[Connection] = []
+    params_list: list[_CaptureParameters] = []
+    for source_id, source in sources.items():
+        output_connection, input_connection = Pipe()
+        urls = {Stream.sd: source} if isinstance(source, str) else source
+        params_list.append(
+            _CaptureParameters(
+                source=urls[Stream.sd],
+                source_hd=urls.get(Stream.hd),
+                source_id=source_id,
+                visualize=source_id == display,
+                event=event,
+                analyses=analyses,
+                input_connection=input_connection,
+                costs=costs,
+            ),
+        )
+        collector.add(output_connection, source_id)
+        connections.append(output_connection)
+    try:
+        await loop.run_in_executor(executor, _run_worker, params_list)
+    finally:
+        for connection in connections:
+            collector.remove(connection)
+
+
+class _ResultCollector:
+    """Collector for the analysis results of all sources, that runs on a single thread.
+
+    This waits on all result connections at once (instead of polling every connection on its own thread),
+    so the amount of threads stays the same for any amount of sources.
+    The results that are available are parsed in batches, see :attr:`Analysis.parse_batch`.
+    """
+
+    def __init__(self) -> None:
+        """Create a collector without connections."""
+        self._connections: dict[Connection, str] = {}
+        self._closing: set[Connection] = set()
+        self._lock = Lock()
+        self._stopped = False
+        # Pipe to wake up the waiting thread when connections change
+        self._wakeup_output, self._wakeup_input = Pipe(duplex=False)
+
+    def add(self, connection: Connection, source_id: str):
+        """Start collecting the results of the given source from the given connection."""
+        with self._lock:
+            self._connections[connection] = source_id
+        self._wakeup_input.send(None)
+
+    def remove(self, connection: Connection):
+        """Stop collecting from the given connection, after the results that are already sent are parsed."""
+        with self._lock:
+            self._closing.add(connection)
+        self._wakeup_input.send(None)
+
+    def stop(self):
+        """Stop collecting, after the results that are already sent are parsed."""
+        self._stopped = True
+        self._wakeup_input.send(None)
+
+    def run(self):
+        """Collect and parse results until the collector is stopped."""
+        while True:
+            with self._lock:
+                connections = list(self._connections)
+                closing = self._closing & self._connections.keys()
+                self._closing.clear()
+            stopping = self._stopped
+            if stopping:
+                closing = set(connections)
+            timeout = 0 if stopping or len(closing) > 0 else None
+            ready = closing.union(wait([self._wakeup_output, *connections], timeout))
+            if self._wakeup_output in ready:
+                while self._wakeup_output.poll():
+                    self._wakeup_output.recv()
+                ready.remove(self._wakeup_output)
+            self._parse(self._receive(ready, closing))
+            for connection in closing:
+                with self._lock:
+                    del self._connections[connection]
+                connection.close()
+            if stopping:
+                return
+
+    def _receive(self, ready: set[Connection], closing: set[Connection]):
+        """Receive the available results from the given connections, grouped by analysis.
+
+        Closing connections are drained completely, others up to :const:`MAX_BATCH_SIZE` messages.
+        """
+        batches: dict[str, list[tuple[Any, str, datetime]]] = {}
+        for connection in ready:
+            source_id = self._connections[connection]
+            count = 0
+            try:
+                while connection.poll() and (count < MAX_BATCH_SIZE or connection in closing):
+                    count += 1
+                    received = time()
+                    for name, (times, results) in decode(connection.recv_bytes(), analyses).items():
+                        if name == METRICS:
+                            for origin, snapshot in results:
+                                registry.update_remote(origin, snapshot)
+                            continue
+                        for latency in received - times:
+                            registry.observe(LAG_METRIC, latency, source=source_id, analysis=name)
+                        batch = batches.setdefault(name, [])
+                        batch.extend(
+                            (result, source_id, datetime.fromtimestamp(timestamp, definitions.TIMEZONE))
+                            for result, timestamp in zip(results, times.tolist(), strict=True)
+                        )
+            except (EOFError, OSError):
+                # The capture process has ended, its results are all received
+                self.remove(connection)
+        return batches
+
+    def _parse(self, batches: dict[str, list[tuple[Any, str, datetime]]]):
+        """Parse the given results with their analyses."""
+        for name, results in batches.items():
+            analysis = analyses[name]
+            try:
+                with timer("analysis_parse_seconds", analysis=name):
+                    if analysis.parse_batch is not None:
+                        analysis.parse_batch(results)
+                    else:
+                        for result, source_id, _ in results:
+                            analysis.parse(result, source_id)
+                registry.increment("analysis_results_total", len(results), analysis=name)
+            except Exception:  # noqa: BLE001 a failing analysis must not stop collecting the results of the others
+                logger.exception(f'Could not parse results of analysis "{name}".')
+
+
+def _run_worker(params_list: list[_CaptureParameters]):
+    """Capture and analyze the given sources in this process, each on a thread of its own."""
+    if not definitions.IS_SERVICE:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Metrics of the parent process were copied when this process was forked
+    registry.clear()
+    threads = [
+        Thread(target=_capture, args=(params,), name=f'Capture "{params["source_id"]}"') for params in params_list
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 
 def _capture(
@@ -135,40 +352,424 @@ def _capture(
 ):
     """Capture video feed for given source and run all given analyses on it.
 
-    This will set up only one input to minimize the I/O usage for camera and this machine.
+    This will set up only one input per stream to minimize the I/O usage for camera and this machine.
+    The SD stream is captured continuously. The HD stream is only captured while an analysis needs it
+    (see :attr:`Analysis.stream`), as decoding it costs much more CPU and bandwidth.
+    The input is reopened when it fails or stalls (see :class:`CaptureSupervisor`), the analyses keep running.
+    The capture is read on this thread without pause, into a slot that only holds the latest frame.
+    Every analysis takes frames from that slot on its own thread, at its own rate. This way, a slow analysis
+    only drops frames itself and never stalls the stream (which would cause decoder errors or a growing delay).
+    Isolated analyses run in their own processes instead (so they do not compete for the GIL of this one)
+    and take the frames from a ring buffer in shared memory.
     Analysis results are all send over the given connection with an analysis identifier prefix to enable parsing.
+    The CPU time of the threads of the source is measured (see :class:`_CpuMeter`), the isolated analyses measure
+    their own processes. The costs are reported as soon as the capture ends, so the parent process gets them
+    even when the analyses take long to finish.
     """
+    source_id = params["source_id"]
+    meter = _CpuMeter()
     logger.debug(f'Starting video capture and analysis for source "{params["source"]}".')
-    if not definitions.IS_SERVICE:
-        signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-    frames = Subject[MatLike]()
-    subjects.add(frames)
+    supervisor = CaptureSupervisor(params["source"], source_id, params["event"].is_set)
+    capture = supervisor.open()
+    if capture is None:
+        return
+    streams, shapes = _get_streams(params, _get_shape(capture))
+    # Motion of the source, for analyses that only run after motion
+    gated = any(analysis.get_gate_cells is not None for analysis in params["analyses"].values())
+    activity = MotionActivity() if gated else None
+    rings, workers = _start_isolated_analyses(params, streams, shapes, activity)
 
-    conn = params["input_connection"]
-    _get_merged_output(frames, params).subscribe(
-        conn.send,
+    sender = ResultSender(params["input_connection"], params["analyses"])
+    for _, connection in workers.values():
+        Thread(target=_forward, args=(connection, sender), daemon=True).start()
+
+    output, inputs = _get_merged_output(params)
+    finished = Event()
+    output.subscribe(
+        _get_output_handler(params, sender, activity),
         on_error=logger.exception,
+        on_completed=finished.set,
         scheduler=scheduler,
     )
 
-    capture = VideoCapture(params["source"], cv2.CAP_FFMPEG)
-    logger.debug(f'Video capture initialized for source "{params["source"]}". Backend: {capture.getBackendName()}')
-    capture_stream = from_capture(capture, params["event"])
-    capture_stream.subscribe(frames, logger.exception)
+    slots = {stream: LatestFrame[Frame]() for stream in shapes}
+    for name, frames in inputs.items():
+        analysis = params["analyses"][name]
+        size = _get_frame_size(analysis, shapes[streams[name]])
+        meter.wrap(
+            from_slot(
+                slots[streams[name]],
+                params["event"],
+                analysis.fps,
+                f'Analysis "{name}" of "{source_id}"',
+                {"source": source_id, "analysis": name},
+                _get_gate(analysis, source_id, size, activity),
+            ),
+        ).pipe(
+            ops.map(_get_scaler(analysis)),
+            ops.subscribe_on(scheduler),
+        ).subscribe(frames, logger.exception)
+
+    used = _get_used_analyses(params, streams, [*inputs, *workers])
+    handlers = {stream: _get_frame_handler(slot, rings.get(stream)) for stream, slot in slots.items()}
+    stop_on_demand = _start_on_demand(params, used[Stream.hd], shapes, handlers, activity, meter)
+    try:
+        # Only decode the frames that are needed by the analysis with the highest frame rate
+        meter.run(supervisor.run, capture, handlers[Stream.sd], _get_fps(used[Stream.sd]))
+    finally:
+        params["costs"][source_id] = meter.get_cores()
+        if stop_on_demand is not None:
+            stop_on_demand()
+        for slot in slots.values():
+            slot.close()
+        for ring in rings.values():
+            ring.close()
+    finished.wait(FINISH_TIMEOUT)
+    for worker, _ in workers.values():
+        worker.join(FINISH_TIMEOUT)
+    for ring in rings.values():
+        ring.release(unlink=True)
+    if activity is not None:
+        activity.release(unlink=True)
+    sender.close()
+
+
+def _get_output_handler(params: _CaptureParameters, sender: ResultSender, activity: MotionActivity | None):
+    """Get a function that sends the results of the analyses and records the motion they found."""
+
+    def on_output(output: tuple[str, tuple[Any, float]]):
+        name, (result, timestamp) = output
+        get_motion = params["analyses"][name].get_motion
+        if activity is not None and get_motion is not None:
+            activity.record(get_motion(result), timestamp)
+        sender.send((name, result), timestamp)
+
+    return on_output
+
+
+def _get_used_analyses(params: _CaptureParameters, streams: dict[str, Stream], names: list[str]):
+    """Get the analyses with the given names that take their frames from each stream."""
+    used: dict[Stream, list[Analysis[Any]]] = {stream: [] for stream in Stream}
+    for name in names:
+        used[streams[name]].append(params["analyses"][name])
+    return used
+
+
+def _start_on_demand(  # noqa: PLR0913 all parameters are needed for the capture
+    params: _CaptureParameters,
+    analyses: list[Analysis[Any]],
+    shapes: dict[Stream, tuple[int, int, int]],
+    handlers: dict[Stream, Callable[[Frame], None]],
+    activity: MotionActivity | None,
+    meter: _CpuMeter,
+):
+    """Start capturing the HD stream of a source on its own thread, while the given analyses need its frames.
+
+    The CPU time of the thread is measured with the given meter.
+
+    :return: Function that stops the capture and waits for it. None if no analysis uses the HD stream.
+    """
+    if len(analyses) == 0:
+        return None
+    source_id = params["source_id"]
+    shape = shapes[Stream.hd]
+    # Separate gates, as checking a gate opens it on a refresh
+    gates = [_get_gate(analysis, source_id, _get_frame_size(analysis, shape), activity) for analysis in analyses]
+    stopped = Event()
+    thread = Thread(
+        target=meter.run,
+        args=(
+            _capture_on_demand,
+            params["source_hd"],
+            f"{source_id} (HD)",
+            lambda: params["event"].is_set() or stopped.is_set(),
+            lambda: any(gate is None or gate() for gate in gates),
+            handlers[Stream.hd],
+            _get_fps(analyses),
+        ),
+        name=f'Capture "{source_id}" (HD)',
+    )
+    thread.start()
+
+    def stop():
+        stopped.set()
+        thread.join()
+
+    return stop
+
+
+def _capture_on_demand(  # noqa: PLR0913 all parameters are options of the capture
+    source: str,
+    source_id: str,
+    should_stop: Callable[[], bool],
+    is_needed: Callable[[], bool],
+    on_frame: Callable[[Frame], None],
+    fps: float | None,
+):
+    """Capture the given source only while its frames are needed, until it should stop.
+
+    The capture is kept open for :const:`HD_IDLE_TIMEOUT` seconds after its frames stopped being needed,
+    so it is not reopened for every short pause of motion.
+    """
+    idle_since: float | None = None
+
+    def should_close():
+        nonlocal idle_since
+        if should_stop():
+            return True
+        if is_needed():
+            idle_since = None
+            return False
+        if idle_since is None:
+            idle_since = monotonic()
+        return monotonic() - idle_since > HD_IDLE_TIMEOUT
+
+    supervisor = CaptureSupervisor(source, source_id, should_close)
+    while not should_stop():
+        if not is_needed():
+            sleep(DEMAND_INTERVAL)
+            continue
+        idle_since = None
+        capture = supervisor.open()
+        if capture is None:
+            continue
+        logger.debug(f'Capturing source "{source_id}", as an analysis needs its frames.')
+        supervisor.run(capture, on_frame, fps)
+        if supervisor.is_file:
+            return
+
+
+def _get_frame_handler(slot: LatestFrame[Frame], ring: SharedFrameRing | None):
+    """Get a function that hands a frame to the analyses of a stream."""
+
+    def on_frame(frame: Frame):
+        slot.put(frame)
+        if ring is not None:
+            ring.put(frame)
+
+    return on_frame
+
 
+def _get_fps(used: list[Analysis[Any]]):
+    """Get the frame rate to decode a stream with, for the given analyses that use it."""
+    rates = [analysis.fps for analysis in used]
+    return None if None in rates or len(rates) == 0 else max(rate for rate in rates if rate is not None)
 
-def _get_merged_output(frames: Subject[MatLike], params: _CaptureParameters):
-    """Create observalbe that combines all analyses.
+
+def _get_shape(capture: cv2.VideoCapture):
+    """Get the shape of the frames of the given capture."""
+    return int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 3
+
+
+def _get_streams(params: _CaptureParameters, shape: tuple[int, int, int]):
+    """Get the stream that every analysis takes its frames from and the frame shape of every used stream.
+
+    The HD stream is opened once to get its frame shape, as it is needed to set up the analyses.
+    Analyses use the SD stream instead, if the source has no HD stream. If it can not be opened, the analyses
+    that want it are removed from the given parameters, as their settings can be in pixels of the HD frames
+    (like the points of a monitored shelf) and the HD frame size is unknown.
+    :param shape: Frame shape of the SD stream.
+    """
+    source_id = params["source_id"]
+    shapes = {Stream.sd: shape}
+    streams = dict.fromkeys(params["analyses"], Stream.sd)
+    wanted = [
+        name
+        for name, analysis in params["analyses"].items()
+        if analysis.stream == Stream.hd and (analysis.is_used is None or analysis.is_used(source_id))
+    ]
+    source_hd = params["source_hd"]
+    if len(wanted) == 0 or source_hd is None or source_hd == params["source"]:
+        return streams, shapes
+    capture = open_capture(source_hd)
+    if capture.isOpened():
+        shapes[Stream.hd] = _get_shape(capture)
+        streams.update(dict.fromkeys(wanted, Stream.hd))
+    else:
+        logger.error(f'Could not open the HD stream of source "{source_id}", not running {", ".join(wanted)} for it.')
+        params["analyses"] = {name: analysis for name, analysis in params["analyses"].items() if name not in wanted}
+    capture.release()
+    return streams, shapes
+
+
+def _get_frame_size(analysis: Analysis[Any], shape: tuple[int, int, int]) -> tuple[int, int]:
+    """Get the size (height, width) of the frames that the given analysis gets from a stream of the given shape."""
+    if analysis.resolution is None:
+        return shape[:2]
+    width, height = analysis.resolution
+    return height, width
+
+
+def _get_scaler(analysis: Analysis[Any]) -> Callable[[Frame], Frame]:
+    """Get a function that scales frames to the resolution of the given analysis."""
+    resolution = analysis.resolution
+    if resolution is None:
+        return lambda frame: frame
+    return lambda frame: Frame(cv2.resize(frame.image, resolution, interpolation=cv2.INTER_AREA), frame.time)
+
+
+def _get_gate(
+    analysis: Analysis[Any],
+    source_id: str,
+    size: tuple[int, int],
+    activity: MotionActivity | None,
+):
+    """Get the motion gate of the given analysis for a source. None if the analysis always runs.
+
+    :param size: Size (height, width) of the frames that the analysis gets.
+    """
+    if activity is None or analysis.get_gate_cells is None:
+        return None
+    cells = analysis.get_gate_cells(source_id, size)
+    return create_gate(activity, cells) if cells is not None else None
+
+
+def _start_isolated_analyses(
+    params: _CaptureParameters,
+    streams: dict[str, Stream],
+    shapes: dict[Stream, tuple[int, int, int]],
+    activity: MotionActivity | None,
+):
+    """Start a process for every isolated analysis, that takes frames from a shared frame ring of its stream.
+
+    :return: The frame rings of the streams that isolated analyses use
+    and the processes of the used analyses, with the connections to receive their results.
+    """
+    isolated = {name: analysis for name, analysis in params["analyses"].items() if analysis.isolated}
+    rings: dict[Stream, SharedFrameRing] = {}
+    started: dict[str, tuple[BaseProcess, Connection]] = {}
+    try:
+        for name, analysis in isolated.items():
+            stream = streams[name]
+            if stream not in rings:
+                rings[stream] = SharedFrameRing(shapes[stream])
+            output_connection, input_connection = Pipe(duplex=False)
+            # Spawn the process, as forking a process with running threads (of the other sources) is unsafe
+            worker = spawn.Process(
+                target=_analyze_isolated,
+                args=(
+                    name,
+                    analysis,
+                    rings[stream].name,
+                    shapes[stream],
+                    activity.name if activity is not None else None,
+                    params,
+                    input_connection,
+                ),
+                name=f'{name} "{params["source_id"]}"',
+            )
+            worker.start()
+            input_connection.close()
+            started[name] = (worker, output_connection)
+    except Exception:
+        for ring in rings.values():
+            ring.close()
+            ring.release(unlink=True)
+        raise
+    workers: dict[str, tuple[BaseProcess, Connection]] = {}
+    for name, (worker, output_connection) in started.items():
+        # Wait until the analysis is set up, it reports whether it is used for this source
+        if not output_connection.poll(READY_TIMEOUT) or not output_connection.recv():
+            worker.join(FINISH_TIMEOUT)
+            continue
+        workers[name] = (worker, output_connection)
+    return rings, workers
+
+
+def _analyze_isolated(  # noqa: PLR0913 all parameters are needed to run the analysis in another process
+    name: str,
+    analysis: Analysis[Any],
+    ring_name: str,
+    shape: tuple[int, int, int],
+    activity_name: str | None,
+    params: _CaptureParameters,
+    connection: Connection,
+):
+    """Run the given analysis in this process, on the frames of a shared frame ring.
+
+    The first message over the given connection tells whether the analysis is used for the source,
+    all following messages are from a :class:`ResultSender`.
+    The results of a frame are only sent if the writer did not overwrite the frame while it was analyzed,
+    see :meth:`SharedFrameRing.is_intact`.
+    The CPU cost of this process is reported when the frames end.
+    """
+    start = monotonic()
+    if not definitions.IS_SERVICE:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    source_id = params["source_id"]
+    ring = SharedFrameRing(shape, ring_name)
+    activity = MotionActivity(activity_name) if activity_name is not None else None
+    frames = Subject[Frame]()
+    results = analysis.analyze(frames, source_id, params["visualize"])
+    connection.send(results is not None)
+    if results is not None:
+        sender = ResultSender(connection, {name: analysis})
+        pending: list[tuple[Any, float]] = []
+        results.subscribe(pending.append, on_error=logger.exception)
+
+        def on_frame(frame: Frame):
+            frames.on_next(frame)
+            if ring.is_intact():
+                for result, timestamp in pending:
+                    sender.send((name, result), timestamp)
+            elif len(pending) > 0:
+                registry.increment("analysis_torn_frames_total", source=source_id, analysis=name)
+                logger.debug(f'Discarded results of "{name}" for "{source_id}", as its frame was overwritten.')
+            pending.clear()
+
+        from_slot(
+            ring,
+            params["event"],
+            analysis.fps,
+            f'Analysis "{name}" of "{source_id}"',
+            {"source": source_id, "analysis": name},
+            _get_gate(analysis, source_id, _get_frame_size(analysis, shape), activity),
+        ).pipe(
+            ops.map(_get_scaler(analysis)),
+        ).subscribe(on_frame, logger.exception, frames.on_completed)
+        for result, timestamp in pending:
+            sender.send((name, result), timestamp)
+        params["costs"][get_isolated_key(source_id, name)] = process_time() / max(monotonic() - start, 1)
+        sender.close()
+    ring.release()
+    if activity is not None:
+        activity.release()
+    connection.close()
+
+
+def _forward(connection: Connection, sender: ResultSender):
+    """Pass the messages of an isolated analysis on."""
+    while True:
+        try:
+            message = connection.recv_bytes()
+        except EOFError:
+            break
+        sender.forward(message)
+
+
+def _get_merged_output(params: _CaptureParameters):
+    """Create observalbe that combines all analyses that run in this process.
 
     This uses the analysis observable that is defined for each analysis and RxPY merge.
+    :return: The merged observable and the frame subjects of the used analyses.
     """
-    output_streams = [_get_output_stream(frames, name, params) for name in analyses]
-    return merge(*(stream for stream in output_streams if stream is not None))
+    inputs: dict[str, Subject[Frame]] = {}
+    used: list[Observable[tuple[str, tuple[Any, float]]]] = []
+    for name, analysis in params["analyses"].items():
+        if analysis.isolated:
+            continue
+        frames = Subject[Frame]()
+        stream = _get_output_stream(frames, name, params)
+        if stream is not None:
+            subjects.add(frames)
+            inputs[name] = frames
+            used.append(stream)
+    return merge(*used), inputs
 
 
 def _get_output_stream(
-    frames: Subject[MatLike],
+    frames: Subject[Frame],
     analysis_name: str,
     params: _CaptureParameters,
 ):
@@ -182,15 +783,3 @@ def _get_output_stream(
             ops.map(lambda result: (analysis_name, result)),
         )
     return None
-
-
-def _parse(output_connection: Connection, camera_id: str):
-    """Parse the analysis results, send over the given connection.
-
-    This can be used to combine all data in a single heap to make it usable by an API or writing process.
-    """
-    while not state.terminating.is_set():
-        if output_connection.poll(1):
-            output: tuple[str, Any] = output_connection.recv()
-            [name, result] = output
-            analyses[name].parse(result, camera_id)
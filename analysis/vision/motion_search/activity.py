@@ -0,0 +1,76 @@
+"""Module for sharing the recent motion of a source with other analyses, to only run them after motion.
+
+The capture process of a source records the time of the last motion of every grid cell in shared memory,
+so analyses in other processes (see :attr:`Analysis.isolated`) can read it without any messages.
+"""
+from __future__ import annotations
+
+from multiprocessing.shared_memory import SharedMemory
+from time import time
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from analysis import definitions
+from analysis.app_logging import logger
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+GATE_HOLD = 5
+"""How long a gate stays open after the last motion (in seconds), so the settled scene is analyzed as well."""
+GATE_REFRESH = 30
+"""How often a gate opens without motion (in seconds), so changes that were missed are still noticed."""
+
+
+class MotionActivity:
+    """Time of the last motion of every grid cell of a source, in shared memory."""
+
+    def __init__(self, name: str | None = None) -> None:
+        """Create the activity of a source, or attach to an existing one if a name is given."""
+        self._memory = SharedMemory(name, create=name is None, size=definitions.CELLS * np.dtype(np.float64).itemsize)
+        self._times = np.ndarray((definitions.CELLS,), dtype=np.float64, buffer=self._memory.buf)
+        if name is None:
+            self._times[:] = 0
+
+    @property
+    def name(self):
+        """Name of the shared memory, to attach to this activity from other processes."""
+        return self._memory.name
+
+    def record(self, change_matrix: NDArray[Any], timestamp: float | None = None):
+        """Record motion for the cells of the given segment matrix, at the given UNIX time (now by default)."""
+        self._times[np.asarray(change_matrix, dtype=np.bool_).reshape(-1)] = time() if timestamp is None else timestamp
+
+    def last(self, cells: NDArray[np.bool_]) -> float:
+        """Get the UNIX time of the last motion in any of the given cells (a mask with the grid size)."""
+        return float(self._times[cells.reshape(-1)].max(initial=0))
+
+    def release(self, unlink: bool = False):
+        """Detach from the shared memory. The creating process should also unlink it, after all readers are done."""
+        del self._times
+        try:
+            self._memory.close()
+        except BufferError:
+            logger.debug("Motion activity is still referenced, it is detached on process exit.")
+        if unlink:
+            self._memory.unlink()
+
+
+def create_gate(activity: MotionActivity, cells: NDArray[np.bool_]):
+    """Create a gate that is open when there was motion in the given cells recently.
+
+    The gate is also open every :const:`GATE_REFRESH` seconds, to refresh results without motion.
+    :return: A function that checks whether the gate is open.
+    """
+    last_open = 0.0
+
+    def is_open():
+        nonlocal last_open
+        now = time()
+        if now - activity.last(cells) <= GATE_HOLD or now - last_open >= GATE_REFRESH:
+            last_open = now
+            return True
+        return False
+
+    return is_open
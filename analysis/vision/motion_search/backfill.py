@@ -0,0 +1,163 @@
+"""Module for analyzing recorded video files for motion, faster than real time.
+
+A recording is split into chunks that start at keyframes, so every chunk can be decoded on its own.
+The chunks are decoded and analyzed in parallel on all cores and the motion is saved in the motion store,
+at the times of the frames in the video (relative to the given start time of the recording).
+"""
+from __future__ import annotations
+
+import json
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from os import cpu_count
+from typing import TYPE_CHECKING, Any, Callable
+
+import cv2
+import numpy as np
+
+from analysis import definitions
+from analysis.app_logging import logger
+from analysis.util.rx import get_stream_fps, sample
+from analysis.vision.motion_search import motion
+from analysis.vision.motion_search.engines import Engine, create_engine, get_engine
+from analysis.vision.motion_search.motion import MotionChange, pack_changes, unpack_changes, update_global_matrices
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+CHUNKS_PER_WORKER = 4
+"""How many chunks to split a recording into per worker process, so the workers finish at about the same time."""
+MIN_CHUNK_DURATION = 10
+"""Shortest duration of a chunk in seconds. Every chunk misses the motion between its first two frames."""
+FFPROBE_TIMEOUT = 600
+
+
+def get_keyframes(path: str) -> list[float] | None:
+    """Get the times (in seconds) of the keyframes of the given video file with ffprobe.
+
+    Only the packets are read, nothing is decoded.
+    :return: The sorted keyframe times. None if ffprobe is not available or fails.
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "json",
+        path,
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, check=True, timeout=FFPROBE_TIMEOUT)  # noqa: S603
+    except (OSError, subprocess.SubprocessError):
+        logger.warning("Could not read the keyframes with ffprobe, splitting the recording at fixed times.")
+        return None
+    packets = json.loads(result.stdout).get("packets", [])
+    return sorted(
+        float(packet["pts_time"])
+        for packet in packets
+        if "K" in packet.get("flags", "") and packet.get("pts_time", "N/A") != "N/A"
+    )
+
+
+def get_chunks(duration: float, chunk_count: int, keyframes: list[float] | None = None):
+    """Split a recording of the given duration (in seconds) into about the given amount of chunks.
+
+    :param keyframes: Times that chunks may start at. The recording is split at any time if not given.
+    :return: The start and end time of every chunk in seconds. The last chunk lasts until the end of the recording.
+    """
+    target = max(duration / max(chunk_count, 1), MIN_CHUNK_DURATION)
+    candidates = keyframes if keyframes is not None else list(np.arange(target, duration, target))
+    starts = [0.0]
+    for time in candidates:
+        if time - starts[-1] >= target and duration - time >= MIN_CHUNK_DURATION:
+            starts.append(time)
+    return list(zip(starts, [*starts[1:], float("inf")], strict=True))
+
+
+def analyze_chunk(path: str, start: float, end: float, engine: Engine) -> tuple[NDArray[np.float64], bytes]:
+    """Analyze the frames of the given video file between the given times (in seconds) for motion.
+
+    Frames are sampled at the frame rate of the live analysis, only sampled frames are converted.
+    Every chunk starts with a new engine, so background subtraction learns the background again.
+    :return: The video times of the results in seconds and the segment matrices (see :func:`pack_changes`).
+    """
+    capture = cv2.VideoCapture(path)
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+    times: list[float] = []
+    changes: list[NDArray[Any]] = []
+    detector = create_engine(engine)
+    for needed in sample(get_stream_fps(capture), motion.FPS):
+        if not capture.grab():
+            break
+        time = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if time >= end:
+            break
+        if not needed or time < start:
+            continue
+        success, frame = capture.retrieve()
+        if not success:
+            continue
+        detection = detector.detect(cv2.resize(frame, motion.RESOLUTION, interpolation=cv2.INTER_AREA))
+        if detection is not None:
+            times.append(time)
+            changes.append(detection.change_matrix)
+    capture.release()
+    return np.array(times, dtype=np.float64), pack_changes(changes) if len(changes) > 0 else b""
+
+
+def backfill(  # noqa: PLR0913 all parameters are options of the backfill
+    path: str,
+    camera_id: str,
+    start: datetime,
+    workers: int | None = None,
+    engine: Engine | None = None,
+    on_progress: Callable[[int, int], None] | None = None,
+):
+    """Analyze the given recording of a camera for motion and save it in the motion store.
+
+    The motion store has to be loaded into the state (see :func:`analysis.read.load_motions`).
+    :param start: Time at which the recording started. The time of a frame is this plus its time in the video.
+    :param workers: Amount of worker processes. All cores by default.
+    :param engine: Motion engine to analyze with. The one of the camera in the settings by default.
+    :param on_progress: Called with the amount of analyzed chunks and the total amount after every chunk.
+    :return: The amount of analyzed frames.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        msg = f'Could not open the recording "{path}".'
+        raise ValueError(msg)
+    duration = capture.get(cv2.CAP_PROP_FRAME_COUNT) / get_stream_fps(capture)
+    capture.release()
+    workers = workers or cpu_count() or 1
+    engine = engine or get_engine(camera_id)
+    chunks = get_chunks(duration, workers * CHUNKS_PER_WORKER, get_keyframes(path))
+    logger.info(
+        f'Analyzing "{path}" ({duration:.0f}s) with the {engine.value} engine, '
+        f"in {len(chunks)} chunks with {workers} processes.",
+    )
+
+    count = 0
+    # Spawn the processes, so OpenCV (and OpenCL) is set up in every one of them
+    with ProcessPoolExecutor(workers, get_context("spawn")) as executor:
+        futures = [
+            executor.submit(analyze_chunk, path, chunk_start, chunk_end, engine) for chunk_start, chunk_end in chunks
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            offsets, data = future.result()
+            if len(offsets) > 0:
+                changes: list[MotionChange] = [
+                    (change_matrix, camera_id, (start + timedelta(seconds=offset)).astimezone(definitions.TIMEZONE))
+                    for change_matrix, offset in zip(unpack_changes(data), offsets.tolist(), strict=True)
+                ]
+                update_global_matrices(changes)
+                count += len(changes)
+            if on_progress is not None:
+                on_progress(done, len(chunks))
+    return count
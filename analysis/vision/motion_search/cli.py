@@ -4,14 +4,18 @@ See __main__ for application.
 """
 # Disable __futures__ import hint as it makes typer unfunctional on python 3.8
 # ruff: noqa: FA100
+from datetime import datetime
 from typing import Optional
 
+import numpy as np
 import typer
 from rich.console import Console
 from typing_extensions import Annotated
 
 from analysis import state
-from analysis.read import load_motions
+from analysis.read import load_legacy_motions, load_motions
+from analysis.util.time import localize
+from analysis.vision.motion_search.engines import Engine
 from analysis.vision.motion_search.read import calculate_heatmap, get_cameras, get_motion_data, print_motion_frames
 from user_secrets import URL
 
@@ -19,12 +23,21 @@ console = Console()
 app = typer.Typer(help="Read saved analysis data.")
 
 
+def _load_writable_motions():
+    """Open the motion store for writing, unless another process (like the analysis service) writes to it."""
+    try:
+        return load_motions()
+    except PermissionError as error:
+        console.print(f"{error} Stop the analysis before changing saved motion.")
+        raise typer.Exit(1) from error
+
+
 @app.command()
 def read(
     source: Annotated[Optional[str], typer.Argument(help="Identifier of the to be read camera.")] = None,
 ):
     """Print out timestamps with motion for the given camera."""
-    state.motions = load_motions()
+    state.motions = load_motions(read_only=True)
     if source is None:
         source = URL
     if (motion_data := get_motion_data(source)) is None:
@@ -37,7 +50,7 @@ def heatmap(
     source: Annotated[Optional[str], typer.Argument(help="Identifier of the to be read camera.")] = None,
 ):
     """Print out heatmap data for a given camera."""
-    state.motions = load_motions()
+    state.motions = load_motions(read_only=True)
     if source is None:
         source = URL
     console.print(calculate_heatmap(source))
@@ -46,9 +59,53 @@ def heatmap(
 @app.command()
 def cameras():
     """Print out cameras with motion data."""
-    state.motions = load_motions()
+    state.motions = load_motions(read_only=True)
     cams = get_cameras()
     if cams is None:
         console.print("No cameras for today.")
         return
     console.print(get_cameras())
+
+
+@app.command()
+def migrate():
+    """Copy the pickled motion data of older versions into the motion store."""
+    from analysis.util.scipy import nonzero
+
+    state.motions = _load_writable_motions()
+    legacy = load_legacy_motions()
+    for day_id, cams in legacy.items():
+        for camera_id, camera_motions in cams.items():
+            cells, index_times = nonzero(camera_motions)
+            state.motions.set(day_id, camera_id, np.asarray(cells), np.asarray(index_times))
+        console.print(f"Migrated {len(cams)} cameras for day {day_id}.")
+    state.motions.close()
+
+
+@app.command()
+def backfill(
+    file: Annotated[str, typer.Argument(help="Path of the recorded video file.")],
+    camera: Annotated[str, typer.Argument(help="Identifier of the camera that recorded the video.")],
+    start_time: Annotated[datetime, typer.Argument(help="Time at which the recording started (local time).")],
+    workers: Annotated[Optional[int], typer.Option(help="Amount of processes. All cores by default.")] = None,  # noqa: UP007
+    engine: Annotated[
+        Optional[Engine],  # noqa: UP007
+        typer.Option(help="Motion engine to analyze with. The one of the camera in the settings by default."),
+    ] = None,
+):
+    """Analyze a recorded video file for motion and save it, faster than real time."""
+    from analysis.vision.motion_search.backfill import backfill as backfill_motion
+
+    state.motions = _load_writable_motions()
+    try:
+        count = backfill_motion(
+            file,
+            camera,
+            localize(start_time),
+            workers,
+            engine,
+            lambda done, total: console.print(f"Analyzed {done}/{total} chunks."),
+        )
+    finally:
+        state.motions.close()
+    console.print(f"Saved the motion of {count} frames for camera {camera}.")
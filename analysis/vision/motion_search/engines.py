@@ -0,0 +1,123 @@
+"""Module for the engines that detect motion in the frames of a source.
+
+An engine is created for every source and gets its frames in order, so it can keep state between them.
+The engine of a camera is chosen in the settings file (see `motion_engines`), frame differencing is the default.
+See https://docs.opencv.org/4.x/d1/dc5/tutorial_background_subtraction.html
+"""
+from __future__ import annotations
+
+from enum import Enum
+from typing import TYPE_CHECKING, NamedTuple, Protocol
+
+import cv2
+import numpy as np
+
+from analysis import definitions
+from analysis.definitions import PATH_SETTINGS
+from analysis.types_adeck import settings
+from analysis.vision.motion_search.motion import _get_changes, analyze_diff, prepare
+
+if TYPE_CHECKING:
+    from cv2.typing import MatLike
+    from numpy.typing import NDArray
+
+engine_settings = settings.load(PATH_SETTINGS).motion_engines
+
+BACKGROUND_SCALE = 0.5
+"""Factor that frames are scaled with for background subtraction, as its cost grows with every pixel."""
+BACKGROUND_HISTORY = 500
+"""Amount of frames that the background model is learned from (100 seconds at the motion frame rate)."""
+SHADOW_THRESHOLD = 200
+"""Lowest value of the foreground mask that is motion. Shadows are marked with 127 by the background subtractors."""
+OPENING_KERNEL = np.ones((3, 3), dtype=np.uint8)
+"""Kernel to remove single changed pixels (like sensor noise) from the foreground mask."""
+
+
+class Engine(str, Enum):
+    """Names of the available motion engines."""
+
+    diff = "diff"
+    mog2 = "mog2"
+    knn = "knn"
+
+
+class Detection(NamedTuple):
+    """Result of a motion engine for a frame, with the intermediate images for visualization."""
+
+    frame: cv2.UMat
+    prepared: cv2.UMat
+    """Grayscale image that was compared."""
+    mask: cv2.UMat
+    """Grayscale image of the detected changes."""
+    change_matrix: NDArray[np.bool_]
+
+
+class MotionEngine(Protocol):
+    """Detector of motion in consecutive frames of a source."""
+
+    def detect(self, frame: MatLike) -> Detection | None:
+        """Detect motion in the given frame, compared to the previous frames. None if there is no result yet."""
+        ...
+
+
+class DiffEngine:
+    """Engine that compares every frame with the previous one, see :func:`analyze_diff`.
+
+    This is cheap, but only detects changes between two frames: Slow motion is missed,
+    while lighting changes and flicker are detected.
+    """
+
+    def __init__(self) -> None:
+        """Create an engine without a previous frame."""
+        self._reference: cv2.UMat | None = None
+
+    def detect(self, frame: MatLike) -> Detection | None:
+        """Detect motion in the given frame, compared to the previous frame."""
+        original, prepared = prepare(frame)
+        reference, self._reference = self._reference, prepared
+        if reference is None:
+            return None
+        return Detection(*analyze_diff(original, prepared, reference))
+
+
+class BackgroundEngine:
+    """Engine that compares every frame with a model of the background, at a reduced resolution.
+
+    The model is learned from the recent frames, so it adapts to gradual changes (like daylight)
+    and to repeating ones (like flicker), while objects are detected until they have stopped for a while.
+    """
+
+    def __init__(self, subtractor: cv2.BackgroundSubtractor) -> None:
+        """Create an engine with the given (untrained) background subtractor."""
+        self._subtractor = subtractor
+        self._trained = False
+
+    def detect(self, frame: MatLike) -> Detection | None:
+        """Detect motion in the given frame and learn it into the background model."""
+        original = cv2.UMat(frame)  # type: ignore - this works anyways, the type definition is falsy
+        height, width = frame.shape[:2]
+        size = (int(width * BACKGROUND_SCALE), int(height * BACKGROUND_SCALE))
+        gray = cv2.cvtColor(cv2.resize(original, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        prepared = cv2.GaussianBlur(gray, (5, 5), 0)
+        mask = self._subtractor.apply(prepared)
+        # The first frame is the whole model, it can not contain motion
+        if not self._trained:
+            self._trained = True
+            return None
+        _, foreground = cv2.threshold(mask, SHADOW_THRESHOLD - 1, 255, cv2.THRESH_BINARY)
+        foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, OPENING_KERNEL)
+        return Detection(original, prepared, foreground, _get_changes(foreground.get(), definitions.GRID_SIZE))
+
+
+def create_engine(engine: Engine) -> MotionEngine:
+    """Create a motion engine of the given kind."""
+    if engine == Engine.mog2:
+        return BackgroundEngine(cv2.createBackgroundSubtractorMOG2(BACKGROUND_HISTORY, detectShadows=True))
+    if engine == Engine.knn:
+        return BackgroundEngine(cv2.createBackgroundSubtractorKNN(BACKGROUND_HISTORY, detectShadows=True))
+    return DiffEngine()
+
+
+def get_engine(source_id: str) -> Engine:
+    """Get the motion engine that is configured for the given source."""
+    return Engine(engine_settings.get(source_id, Engine.diff))
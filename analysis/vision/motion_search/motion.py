@@ -2,73 +2,83 @@
 from __future__ import annotations
 
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Sequence
 
 import cv2
 import numpy as np
-from reactivex.operators import do_action, pairwise, throttle_first
+from reactivex.operators import do_action, throttle_first
+from reactivex.operators import filter as filter_op
 from reactivex.operators import map as map_op
-from scipy.sparse import lil_array
 
 from analysis import definitions, state
 from analysis.app_logging import logger
+from analysis.util.bits import pack, packed_size, unpack
 from analysis.util.image import draw_grid, draw_overlay
-from analysis.util.time import seconds_since_midnight
+from analysis.util.metrics import STAGE_METRIC, timed
+from analysis.util.rx import THROTTLE_TOLERANCE
+from analysis.util.time import get_date_floored
 
 if TYPE_CHECKING:
     from cv2.typing import MatLike
     from numpy.typing import NDArray
     from reactivex import Observable
 
-DAY_IN_SECONDS = int(timedelta(days=1).total_seconds())
-TIMEFRAMES = int(DAY_IN_SECONDS / definitions.INTERVAL)
+    from analysis.util.frames import Frame
 
 FPS = 5
 TIME_PER_FRAME = 1 / FPS
+RESOLUTION = (640, 360)
+"""Size (width, height) of the frames that motion is detected in.
 
+Motion is only detected per grid cell, so the full resolution of a stream is not needed.
+"""
 
-def _get_changes(diff: MatLike, grid_size: tuple[int, int]):
-    """Get the changes represented by the given difference image in a segment matrix."""
-    # A linear resize could be a more performant alternative to this and could be tried to improve performance
-    # Get the dimensions of the image
-    height, width = diff.shape
+MotionChange = tuple["NDArray[Any]", str, datetime]
+"""A segment matrix with the ID of its camera and the time it was recorded."""
 
+
+def _get_changes(diff: MatLike, grid_size: tuple[int, int]) -> NDArray[np.bool_]:
+    """Get the changes represented by the given difference image in a segment matrix.
+
+    The image is reduced in a single pass, using a view that splits both axes into cells.
+    Remaining pixels at the right and bottom edge that do not fill a whole cell belong to the last column and row.
+    """
+    image = np.asarray(diff)
+    height, width = image.shape[:2]
+    rows, columns = grid_size
     # Calculate the size of each cell in the grid
-    cell_height = height // grid_size[0]
-    cell_width = width // grid_size[1]
-
-    # Initialize the boolean matrix
-    boolean_matrix = np.zeros(grid_size, dtype=bool)
-
-    # Iterate over the cells in the grid
-    for y in range(grid_size[0]):
-        for x in range(grid_size[1]):
-            # Extract the current cell from the image
-            cell = diff[
-                y * cell_height : (y + 1) * cell_height,
-                x * cell_width : (x + 1) * cell_width,
-            ]
-            # Check if the cell contains any non-zero values
-            if has_values := np.any(cell != 0):  # pyright: ignore[reportUnknownMemberType]
-                # Update the boolean matrix
-                boolean_matrix[y, x] = has_values
-    return boolean_matrix
-
-
-def analyze_motion(frames: Observable[MatLike], source_id: str, show: bool):
-    """Analyze frames from given observable for motion."""
-    logger.info(f'Starting motion monitoring for "{source_id}"')
+    cell_height = height // rows
+    cell_width = width // columns
+    cells = image[: rows * cell_height, : columns * cell_width].reshape((rows, cell_height, columns, cell_width))
+    changes = cells.any(axis=(1, 3))
+    if height > rows * cell_height:
+        changes[-1] |= _get_changes(image[rows * cell_height :], (1, columns))[0]
+    if width > columns * cell_width:
+        changes[:, -1] |= _get_changes(image[:, columns * cell_width :], (rows, 1))[:, 0]
+    return changes
+
+
+def analyze_motion(frames: Observable[Frame], source_id: str, show: bool):
+    """Analyze frames from given observable for motion.
+
+    :return: Observable of segment matrices, with the capture time of their frame.
+    """
+    # Imported here, as the engines build on the functions of this module
+    from analysis.vision.motion_search.engines import create_engine, get_engine
+
+    engine = get_engine(source_id)
+    logger.info(f'Starting motion monitoring for "{source_id}" with the {engine.value} engine')
+    detect_timed = timed(create_engine(engine).detect, STAGE_METRIC, source=source_id, stage="detect")
     return frames.pipe(
         # Apply FPS
-        throttle_first(TIME_PER_FRAME),
-        # Apply image preparation for analysis
-        map_op(prepare),
-        # Keep the previous frame for diff
-        pairwise(),
-        map_op(lambda pair: analyze_diff(pair[1][0], pair[1][1], pair[0][1])),
+        throttle_first(TIME_PER_FRAME * THROTTLE_TOLERANCE),
+        # Detect the motion of the frame in order, keep the capture time
+        map_op(lambda frame: (detect_timed(frame.image), frame.time)),
+        # The engine has no result until it has seen enough frames
+        filter_op(lambda t: t[0] is not None),
         # Display
-        do_action(lambda t: visualize(t[0], t[1], t[2], t[3]) if show else None),
-        map_op(lambda t: t[3]),
+        do_action(lambda t: visualize(*t[0]) if show else None),
+        map_op(lambda t: (t[0].change_matrix, t[1])),
     )
 
 
@@ -77,25 +87,44 @@ def update_global_matrix(
     camera_id: str,
 ):
     """Update the global motion store with the given segment matrix."""
-    non_zero = change_matrix.nonzero()
-    for index, y in enumerate(non_zero[0]):
-        x = non_zero[1][index]
-        # Update the global matrix
-        index_cell = y * definitions.GRID_SIZE[1] + x
-        seconds = seconds_since_midnight(datetime.now(definitions.TIMEZONE))
-        index_time = int(seconds / definitions.INTERVAL)
+    update_global_matrices([(change_matrix, camera_id, datetime.now(definitions.TIMEZONE))])
+
+
+def update_global_matrices(changes: Sequence[MotionChange]):
+    """Update the global motion store with a batch of segment matrices.
+
+    The matrices can be from different cameras and times.
+    All changes of a camera and day are written to the store in a single vectorized operation.
+    """
+    if len(changes) == 0:
+        return
+    midnight = get_date_floored(changes[0][2])
+    offsets = np.array([(time - midnight).total_seconds() for _, _, time in changes])
+    day_offsets = (offsets // definitions.DAY_IN_SECONDS).astype(np.int64)
+    index_times = (offsets % definitions.DAY_IN_SECONDS // definitions.INTERVAL).astype(np.int64)
+    matrices = np.stack([change_matrix.reshape(-1) for change_matrix, _, _ in changes])
+
+    groups: dict[tuple[int, str], list[int]] = {}
+    for index, (_, camera_id, _) in enumerate(changes):
+        groups.setdefault((int(day_offsets[index]), camera_id), []).append(index)
+
+    for (day_offset, camera_id), indices in groups.items():
+        rows, cells = np.nonzero(matrices[indices])
+        if len(cells) == 0:
+            continue
+        day_id = str((midnight + timedelta(days=day_offset)).date())
+        state.motions.set(day_id, camera_id, cells, index_times[indices][rows])
+
 
-        id_day = str(datetime.now(definitions.TIMEZONE).date())
-        if id_day not in state.motions:
-            state.motions[id_day] = {}
-        day = state.motions[id_day]
+def pack_changes(change_matrices: Sequence[NDArray[Any]]):
+    """Encode the given segment matrices as bit-packed cell masks, for the transport to the parent process."""
+    return pack(np.stack(change_matrices).reshape(len(change_matrices), -1)).tobytes()
 
-        id_cam = camera_id
-        if id_cam not in day:
-            day[id_cam] = lil_array((definitions.CELLS, TIMEFRAMES), dtype=bool)
-        camera_motions = day[id_cam]
 
-        camera_motions[index_cell, index_time] = True
+def unpack_changes(data: bytes) -> NDArray[np.bool_]:
+    """Decode segment matrices that were encoded with :func:`pack_changes`."""
+    masks = np.frombuffer(data, dtype=np.uint8).reshape(-1, packed_size(definitions.CELLS))
+    return unpack(masks, definitions.CELLS).reshape(-1, *definitions.GRID_SIZE)
 
 
 def show_two(x1: MatLike, x2: MatLike):
@@ -137,6 +166,10 @@ def analyze_diff(original: cv2.UMat, frame: cv2.UMat, reference_frame: cv2.UMat)
 
 def visualize(frame: cv2.UMat, gray_blurred: cv2.UMat, frame_diff: cv2.UMat, change_matrix: NDArray[Any]):
     """Visualize the motion analysis flow."""
+    # Engines may detect motion in smaller images than the frame
+    height, width = frame.get().shape[:2]
+    gray_blurred = cv2.resize(gray_blurred, (width, height))
+    frame_diff = cv2.resize(frame_diff, (width, height))
     grid = draw_grid(frame.get().copy(), definitions.GRID_SIZE)
     overlayed = draw_overlay(grid, change_matrix)
 
@@ -153,6 +186,4 @@ def visualize(frame: cv2.UMat, gray_blurred: cv2.UMat, frame_diff: cv2.UMat, cha
 
 def write_motion():
     """Write motion data from local state to disk."""
-    with definitions.PATH_MOTIONS.open("wb") as f:
-        np.save(f, np.asanyarray(state.motions))  # pyright: ignore[reportUnknownMemberType]
-        logger.info("Wrote motion analysis results to disk.")
+    state.motions.close()
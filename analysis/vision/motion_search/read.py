@@ -4,98 +4,202 @@ This is done by reading and interpreting motion data from the local state."""
 from __future__ import annotations
 
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from functools import reduce
-from operator import add
 from time import perf_counter
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, NamedTuple
 
+import numpy as np
 from rich.console import Console
 
 from analysis import definitions, state
 from analysis.read import load_motions
-from analysis.util.scipy import combine_or, getrow, nnz, nonzero
-from analysis.util.time import today
+from analysis.util.bits import combine_or, unpack
+from analysis.util.time import get_date_floored, get_day_range, today
+from analysis.vision.motion_search.store import select_level
 
 if TYPE_CHECKING:
     from cv2.typing import Rect
-    from scipy.sparse import lil_array
+    from numpy.typing import NDArray
+
+    from analysis.vision.motion_search.store import MotionStore
 
 console = Console()
+executor = ThreadPoolExecutor(None, "MotionRead")
+"""Executor for reading the day shards of a time range in parallel."""
+
+
+class DaySection(NamedTuple):
+    """Section of a day inside a queried time range."""
+
+    day_id: str
+    offset: int
+    """Time frame index of the start of the day, relative to the start of the time range."""
+    start: int
+    """Index of the first time frame of the day inside the time range."""
+    stop: int
+    """Index of the first time frame of the day after the time range."""
+
+
+def get_day_sections(start: datetime, end: datetime):
+    """Split the given time range into sections of single days."""
+    sections: list[DaySection] = []
+    midnight = get_date_floored(start)
+    while midnight < end:
+        day_start = max(start, midnight)
+        day_end = min(end, midnight + timedelta(days=1))
+        sections.append(
+            DaySection(
+                str(midnight.date()),
+                _to_time_frames(midnight - start),
+                _to_time_frames(day_start - midnight),
+                _to_time_frames(day_end - midnight),
+            ),
+        )
+        midnight += timedelta(days=1)
+    return sections
+
+
+def _to_time_frames(duration: timedelta):
+    return int(duration.total_seconds() // definitions.INTERVAL)
 
 
-def print_motion_frames(camera_motions: lil_array):
-    """Print non zero entries from a given motion sparse matrix."""
-    cell_amount = camera_motions.shape[0]
-    cells = [getrow(camera_motions, cell_index) for cell_index in range(cell_amount)]
-    merged = combine_or(cells)
-    for index in nonzero(merged)[1]:
-        console.print(today() + timedelta(seconds=int(index)))
+def print_motion_frames(camera_motions: NDArray[np.uint8]):
+    """Print non zero entries from a given bit-packed motion matrix."""
+    merged = unpack(combine_or(camera_motions), definitions.TIMEFRAMES)
+    for index in np.flatnonzero(merged):
+        console.print(today() + timedelta(seconds=int(index) * definitions.INTERVAL))
 
 
-def get_motions_in_area(
-    motions: definitions.MotionData,
+def get_motions_in_area(  # noqa: PLR0913 all parameters are needed for the query
+    motions: MotionStore,
     camera_id: str,
     bounds_rect: Rect,
-):
-    """Get all motion entries in the given cell section."""
+    day_id: str | None = None,
+    level: int = 1,
+    start: int = 0,
+    stop: int = definitions.TIMEFRAMES,
+) -> NDArray[np.bool_]:
+    """Get all motion entries in the given cell section.
+
+    :param day_id: The day to read. Defaults to today.
+    :param level: Time resolution, see :func:`analysis.vision.motion_search.store.select_level`.
+    :param start: Index of the first time frame to read. Must be a multiple of the level.
+    :param stop: Index of the time frame after the last one to read. Must be a multiple of the level.
+    :return: A boolean array that states for every time span in the range whether a motion occurred.
+    """
     [cell_x, cell_y, cell_width, cell_height] = bounds_rect
-    day_id = str(datetime.now(definitions.TIMEZONE).date())
-    camera_motions = motions[day_id][camera_id]
-    indices_rows = [
-        [
-            *range(
-                (cell_y + y) * definitions.GRID_SIZE[1] + cell_x,
-                (cell_y + y) * definitions.GRID_SIZE[1] + cell_x + cell_width,
-            ),
-        ]
-        for y in range(cell_height)
-    ]
-    indices = reduce(add, indices_rows)
-    rows = [getrow(camera_motions, index) for index in indices]
-    return combine_or(rows)
+    if day_id is None:
+        day_id = str(datetime.now(definitions.TIMEZONE).date())
+    merged = motions.get_in_area(day_id, camera_id, (cell_x, cell_y, cell_width, cell_height), level, start, stop)
+    if merged is None:
+        return np.zeros((stop - start) // level, dtype=np.bool_)
+    return merged
+
+
+def get_motions_in_range(  # noqa: PLR0913 all parameters are needed for the query
+    motions: MotionStore,
+    camera_id: str,
+    bounds_rect: Rect,
+    start: datetime,
+    end: datetime,
+    span_size: int = 1,
+) -> NDArray[np.int64]:
+    """Get all motion entries in the given cell section and time range, merged into a single timeline.
+
+    Only the day shards inside the time range are read, in parallel.
+    :return: Sorted indices of the time spans with motion, relative to the start of the time range.
+    """
+    sections = get_day_sections(start, end)
+    # The time resolution must align with the time range, so it answers the query exactly
+    level = select_level(span_size, *(frame for section in sections for frame in (section.start, section.stop)))
+
+    def get_section(section: DaySection):
+        merged = get_motions_in_area(
+            motions,
+            camera_id,
+            bounds_rect,
+            section.day_id,
+            level,
+            section.start,
+            section.stop,
+        )
+        return section.offset + section.start + np.flatnonzero(merged) * level
+
+    results = [*executor.map(get_section, sections)]
+    if len(results) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(results) // span_size)
+
+
+def to_intervals(indices: NDArray[np.int64]):
+    """Get the given sorted time span indices as run-length encoded intervals [start, end).
+
+    The runs are found in the indices directly, so no timeline of the whole range is allocated.
+    """
+    if len(indices) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    # A run ends wherever the next index does not follow directly
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.concatenate(([0], breaks))]
+    ends = indices[np.concatenate((breaks - 1, [len(indices) - 1]))] + 1
+    return np.stack((starts, ends), axis=-1).astype(np.int64)
 
 
 def get_cameras():
     """Get all camera motion data collections that actually have nonzero data."""
     day_id = str(datetime.now(definitions.TIMEZONE).date())
-    cams = state.motions.get(day_id, None)
-    return cams.keys() if cams is not None else None
+    cams = state.motions.cameras(day_id)
+    return cams if len(cams) != 0 else None
 
 
 def get_motion_data(camera_id: str):
     """Get all recorded motion entries for the given camera."""
     day_id = str(datetime.now(definitions.TIMEZONE).date())
-    cams = state.motions.get(day_id, None)
-    if cams is None:
+    if day_id not in state.motions.days():
         console.print(f"No entries for day {day_id}")
         return None
-    camera_motion_data = cams.get(camera_id, None)
+    camera_motion_data = state.motions.get(day_id, camera_id)
     if camera_motion_data is None:
         console.print(f'No entries for source "{camera_id}"')
         return None
     return camera_motion_data
 
 
-def calculate_heatmap(camera_id: str):
-    """Get the count of motions for every segment."""
-    if (motion_data := get_motion_data(camera_id)) is None:
+def calculate_heatmap(camera_id: str, start: datetime | None = None, end: datetime | None = None):
+    """Get the count of motions for every segment.
+
+    Without a time range, today is used.
+    The counts are read from the hourly counters of the motion store.
+    """
+    if start is None or end is None:
+        if get_motion_data(camera_id) is None:
+            return None
+        (start, end) = get_day_range(datetime.now(definitions.TIMEZONE))
+
+    def get_section(section: DaySection):
+        return state.motions.count(section.day_id, camera_id, section.start, section.stop)
+
+    sections = get_day_sections(start, end)
+    # Avoid the overhead of the executor for the common single day heatmap
+    results = [get_section(sections[0])] if len(sections) == 1 else executor.map(get_section, sections)
+    counts = [result for result in results if result is not None]
+    if len(counts) == 0:
         return None
-    cell_amount = motion_data.shape[0]
-    cells = [getrow(motion_data, cell_index) for cell_index in range(cell_amount)]
-    return [nnz(cell) for cell in cells]
+    return np.sum(counts, axis=0).tolist()
 
 
 if __name__ == "__main__":
-    state.motions = load_motions()
+    state.motions = load_motions(read_only=True)
     start_time = perf_counter()
     # Get recorded motion data
     day_id = str(datetime.now(definitions.TIMEZONE).date())
-    cams = state.motions.get(day_id, None)
-    if cams is None:
+    camera_ids = state.motions.cameras(day_id)
+    if len(camera_ids) == 0:
         console.print(f"No entries for day {day_id}")
         sys.exit()
-    nonz = {camera_id: cam for camera_id, cam in cams.items() if len(nonzero(cam)[1]) != 0}
+    cams = {camera_id: state.motions.get(day_id, camera_id) for camera_id in camera_ids}
+    nonz = {camera_id: cam for camera_id, cam in cams.items() if cam is not None and cam.any()}
 
     # Print recorded motion data
     for camera_id in nonz:
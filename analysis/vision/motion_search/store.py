@@ -0,0 +1,497 @@
+"""Module that implements the storage engine for motion search data.
+
+Motion data is saved in one fixed-size file per day and camera, located at `<store>/<day>/<camera>.bits`.
+Each file contains a bit-packed matrix with one row per cell and one bit per time frame of the day.
+The files are memory-mapped with NumPy, so writes set bits in place and reads only load the pages that are needed.
+Opening the store is therefore independent from how much history is saved.
+
+Area queries combine the packed rows of the cells in the section with a bitwise or, only for the queried range.
+This reads at most one row per cell of the grid, so the latency hardly grows with the size of the section,
+while ingestion only writes the motion bits (and the derived data below).
+
+Coarser time resolutions (see :const:`LEVELS`) are materialized at `<store>/<day>/<camera>.levels`.
+Each level is a bit-packed motion matrix, where a bit is set if any time frame of its span had motion.
+Queries with a coarse resolution therefore read a fraction of the data.
+
+Motion counts of every cell are kept per hour at `<store>/<day>/<camera>.heat`, so heatmaps for windows of whole
+hours are calculated by summing a few small integer arrays.
+
+Ingestion sets the motion bits in every time resolution and counts the new ones in the hourly counts,
+so readers of the mapped files see all of them right away and queries never have to update derived data.
+
+Mapped shards are kept in a least recently used cache with a memory budget (see `SHARD_CACHE_BUDGET`).
+The shards of today and yesterday are never evicted, older ones are mapped again when they are needed.
+
+Changes are logged in a write-ahead log before they are applied (see :module:`wal`).
+A background thread regularly folds the log into the store with a checkpoint.
+Only one process may write to the store, so the writer holds an exclusive lock on its directory (see `flock(2)`).
+
+See https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+"""
+from __future__ import annotations
+
+import fcntl
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from threading import Event, RLock, Thread
+from typing import TYPE_CHECKING, Any, TypedDict
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from analysis import definitions
+from analysis.app_logging import logger
+from analysis.util.bits import (
+    combine_or,
+    get_bits,
+    pack,
+    packed_size,
+    popcount,
+    popcount_range,
+    set_bits,
+    set_column,
+    unpack,
+)
+from analysis.vision.motion_search.wal import WriteAheadLog
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from numpy.typing import NDArray
+
+SHAPE = (definitions.CELLS, packed_size(definitions.TIMEFRAMES))
+"""Shape of the bit-packed matrix of a single day and camera."""
+LEVELS = (10, 30, 60, 300, 3600)
+"""Spans of the materialized coarser time resolutions, in time frames. Every span must divide a day."""
+_LEVEL_SIZES = [packed_size(definitions.TIMEFRAMES // level) for level in LEVELS]
+_LEVEL_SPANS = np.array(LEVELS)
+_LEVEL_OFFSETS = np.cumsum([0, *_LEVEL_SIZES])
+SHAPE_LEVELS = (definitions.CELLS, sum(_LEVEL_SIZES))
+"""Shape of the file with all coarser time resolutions of a single day and camera, concatenated by column."""
+HOUR = 3600 // definitions.INTERVAL
+"""Amount of time frames in an hour."""
+SHAPE_HEAT = (definitions.TIMEFRAMES // HOUR, definitions.CELLS)
+"""Shape of the hourly motion counts (unsigned 32 bit integers) of a single day and camera."""
+SUFFIX_BITS = ".bits"
+SUFFIX_LEVELS = ".levels"
+SUFFIX_HEAT = ".heat"
+FILE_NAME_WAL = "motions.wal"
+
+
+def _get_file_name(camera_id: str):
+    """Get a file name for the given camera ID.
+
+    Camera IDs can be URLs (see `analyze` command), so they are escaped.
+    """
+    return quote(camera_id, safe="")
+
+
+def select_level(span_size: int, *alignments: int):
+    """Get the coarsest time resolution that can answer a query with the given span size exactly.
+
+    :param alignments: Time frame indices that must be at the border of a span of the time resolution,
+    for example the start and end of a queried time range.
+    """
+    return max(
+        (level for level in (1, *LEVELS) if all(value % level == 0 for value in (span_size, *alignments))),
+        default=1,
+    )
+
+
+def _get_in_area(bits: NDArray[np.uint8], bounds: tuple[int, int, int, int], first: int, last: int):
+    """Get whether a bit is set in the given cell section of a bit-packed matrix, for every bit in [first, last)."""
+    (x, y, width, height) = bounds
+    # Combine the rows of all cells in the section, only reading the bytes of the range
+    grid = bits.reshape((*definitions.GRID_SIZE, -1))[:, :, first // 8 : packed_size(last)]
+    rows = grid[y : y + height, x : x + width].reshape((-1, grid.shape[-1]))
+    return unpack(combine_or(rows))[first % 8 : first % 8 + last - first]
+
+
+@dataclass
+class _Shard:
+    """Memory-mapped files of a single day and camera."""
+
+    bits: NDArray[np.uint8]
+    """Bit-packed motion matrix. This is a plain array view of the mapped file, as memmap indexing is slow."""
+    levels: dict[int, NDArray[np.uint8]] = field(default_factory=dict)
+    """Bit-packed motion matrices with coarser time resolutions, mapped by their span (see :const:`LEVELS`)."""
+    level_matrix: NDArray[np.uint8] | None = None
+    """All coarser time resolutions in one matrix, see :const:`SHAPE_LEVELS`. The levels are views of its columns."""
+    heat: NDArray[np.uint32] | None = None
+    """Hourly motion counts of every cell, see :const:`SHAPE_HEAT`. This can be missing for read only stores."""
+    files: list[np.memmap[Any, np.dtype[Any]]] = field(default_factory=list)
+    """All mapped files of this shard, for flushing."""
+
+    @property
+    def size(self):
+        """Size of all mapped files of this shard in bytes."""
+        return sum(file.nbytes for file in self.files)
+
+    def flush(self):
+        """Write all changes of this shard to disk."""
+        for file in self.files:
+            file.flush()
+
+    def set(self, cells: NDArray[np.int64], index_times: NDArray[np.int64]):
+        """Save motion for the given cell and time frame indices in every time resolution and in the hourly counts.
+
+        Only motion that is not saved yet is counted, so saving the same motion twice keeps the counts.
+        Motion is never removed, so the coarser time resolutions only need the new motion as well.
+        """
+        if (index_times == index_times[0]).all():
+            self._set_time_frame(cells, int(index_times[0]))
+            return
+        if self.heat is not None:
+            positions = np.unique(cells * definitions.TIMEFRAMES + index_times)
+            new_cells, new_times = np.divmod(positions, definitions.TIMEFRAMES)
+            is_new = ~get_bits(self.bits, new_cells, new_times)
+            np.add.at(self.heat, (new_times[is_new] // HOUR, new_cells[is_new]), 1)
+        set_bits(self.bits, cells, index_times)
+        if self.level_matrix is not None:
+            # Bit indices in all levels at once, as they are concatenated by column
+            indices = _LEVEL_OFFSETS[:-1] * 8 + index_times[:, np.newaxis] // _LEVEL_SPANS
+            set_bits(self.level_matrix, np.repeat(cells, len(LEVELS)), indices.ravel())
+
+    def _set_time_frame(self, cells: NDArray[np.int64], index_time: int):
+        """Save motion for the given cells at a single time frame, like every change matrix of a live source."""
+        if self.heat is not None:
+            is_new = (self.bits[cells, index_time >> 3] & np.uint8(1 << (index_time & 7))) == 0
+            # A buffered assignment only adds once for duplicate cells, so their motion is counted once
+            counts = self.heat[index_time // HOUR]
+            counts[cells] += is_new
+        set_column(self.bits, cells, index_time)
+        if self.level_matrix is not None:
+            # The bit of every level is in a separate column, so all levels are set with a single assignment
+            spans = index_time // _LEVEL_SPANS
+            columns = _LEVEL_OFFSETS[:-1] + (spans >> 3)
+            self.level_matrix[cells[:, np.newaxis], columns] |= (1 << (spans & 7)).astype(np.uint8)
+
+    def recount(self, start: int, stop: int):
+        """Count the motion of the hours that overlap the time frame range [start, stop) again."""
+        if self.heat is None:
+            return
+        first_hour, last_hour = start // HOUR, -(-stop // HOUR)
+        packed = self.bits[:, first_hour * HOUR // 8 : last_hour * HOUR // 8]
+        hours = packed.reshape((definitions.CELLS, last_hour - first_hour, -1))
+        self.heat[first_hour:last_hour] = popcount(hours).T
+
+
+class CacheInfo(TypedDict):
+    """Statistics of the shard cache of a motion store."""
+
+    hits: int
+    misses: int
+    evictions: int
+    shards: int
+    """Amount of currently mapped shards."""
+    size: int
+    """Size of all currently mapped shards in bytes."""
+    budget: int
+
+
+class MotionStore:
+    """Memory-mapped store for the motion data of all days and cameras."""
+
+    def __init__(self, path: Path, read_only: bool = False, cache_budget: int = definitions.SHARD_CACHE_BUDGET) -> None:
+        """Open the store located at the given directory. No data is read at this point."""
+        self.path = path
+        self.read_only = read_only
+        self.cache_budget = cache_budget
+        self._shards: OrderedDict[tuple[str, str], _Shard] = OrderedDict()
+        self._lock = RLock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._wal: WriteAheadLog | None = None
+        self._stopped = Event()
+        self._checkpointer: Thread | None = None
+        self._descriptor: int | None = None
+
+    def recover(self, checkpoint_interval: float = definitions.CHECKPOINT_INTERVAL):
+        """Replay the write-ahead log and start logging changes with regular checkpoints.
+
+        This locks the store for the single process that writes to it, until it is closed.
+        :raises PermissionError: If the store is read only or another process writes to it.
+        """
+        if self.read_only:
+            raise PermissionError("The motion store was opened read only.")
+        self._lock_directory()
+        self._wal = WriteAheadLog(self.path / FILE_NAME_WAL)
+        replayed: dict[tuple[str, str], tuple[int, int]] = {}
+        for day_id, camera_id, cells, index_times in self._wal.replay():
+            self._set(day_id, camera_id, cells, index_times)
+            if len(index_times) != 0:
+                start, stop = replayed.get((day_id, camera_id), (definitions.TIMEFRAMES, 0))
+                start, stop = min(start, int(np.min(index_times))), max(stop, int(np.max(index_times)) + 1)
+                replayed[day_id, camera_id] = (start, stop)
+        # The motion bits of the log can be on disk without their counts (or the other way round) after a crash,
+        # so the replayed hours are counted again
+        for (day_id, camera_id), (start, stop) in replayed.items():
+            if (shard := self._open(day_id, camera_id, create=False)) is not None:
+                shard.recount(start, stop)
+        if len(replayed) != 0:
+            logger.info(f"Replayed the motion WAL for {len(replayed)} days and cameras.")
+        self.checkpoint()
+        self._checkpointer = Thread(
+            target=self._run_checkpoints,
+            args=(checkpoint_interval,),
+            name="MotionCheckpoint",
+            daemon=True,
+        )
+        self._checkpointer.start()
+
+    def checkpoint(self):
+        """Fold the write-ahead log into the store.
+
+        Only pages that changed since the last checkpoint are written.
+        """
+        if self._wal is None:
+            self.flush()
+            return
+        with self._lock:
+            # Without a rotation, the changes of the current log stay in it and are checkpointed the next time
+            self._wal.rotate()
+            shards = [*self._shards.values()]
+        # Every change of the rotated log was applied before the rotation, flushing makes them persistent
+        for shard in shards:
+            shard.flush()
+        self._wal.discard_rotated()
+        logger.debug("Checkpointed motion store.")
+
+    def close(self):
+        """Stop the checkpoints and write all changes to disk."""
+        self._stopped.set()
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        self.checkpoint()
+        if self._wal is not None:
+            self._wal.close()
+        if self._descriptor is not None:
+            # Closing the directory releases its lock
+            os.close(self._descriptor)
+            self._descriptor = None
+        logger.info("Wrote motion analysis results to disk.")
+
+    def _lock_directory(self):
+        """Lock the directory of the store, so no other process writes to it at the same time."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        descriptor = os.open(self.path, os.O_RDONLY)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(descriptor)
+            msg = f'The motion store at "{self.path}" is written by another process.'
+            raise PermissionError(msg) from None
+        self._descriptor = descriptor
+
+    def _run_checkpoints(self, interval: float):
+        while not self._stopped.wait(interval):
+            try:
+                self.checkpoint()
+            except OSError:
+                logger.exception("Checkpoint of the motion store failed.")
+
+    def cache_info(self) -> CacheInfo:
+        """Get statistics of the shard cache, for tuning its budget."""
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "shards": len(self._shards),
+                "size": sum(shard.size for shard in self._shards.values()),
+                "budget": self.cache_budget,
+            }
+
+    def days(self):
+        """Get the IDs of all days that have motion data."""
+        if not self.path.is_dir():
+            return []
+        return sorted(entry.name for entry in self.path.iterdir() if entry.is_dir())
+
+    def cameras(self, day_id: str):
+        """Get the IDs of all cameras that have motion data for the given day."""
+        day_path = self.path / day_id
+        if not day_path.is_dir():
+            return []
+        return sorted(unquote(entry.stem) for entry in day_path.glob(f"*{SUFFIX_BITS}"))
+
+    def get(self, day_id: str, camera_id: str) -> NDArray[np.uint8] | None:
+        """Get the bit-packed motion matrix of the given day and camera.
+
+        :return: None - No motion data exists for the given day and camera.
+        """
+        shard = self._open(day_id, camera_id, create=False)
+        return shard.bits if shard is not None else None
+
+    def get_in_area(  # noqa: PLR0913 all parameters are needed for the query
+        self,
+        day_id: str,
+        camera_id: str,
+        bounds: tuple[int, int, int, int],
+        level: int = 1,
+        start: int = 0,
+        stop: int = definitions.TIMEFRAMES,
+    ) -> NDArray[np.bool_] | None:
+        """Get whether a motion occurred in the given cell section (x, y, width, height) for every time span.
+
+        :param level: Time resolution of the result. Must be 1 or one of :const:`LEVELS`.
+        :param start: Index of the first time frame of the result. Must be a multiple of the level.
+        :param stop: Index of the time frame after the last one of the result. Must be a multiple of the level.
+        :return: None - No motion data exists for the given day and camera.
+        """
+        shard = self._open(day_id, camera_id, create=False)
+        if shard is None:
+            return None
+        if level != 1 and level not in LEVELS:
+            msg = f"There is no time resolution with a span of {level}."
+            raise ValueError(msg)
+        if level == 1:
+            return _get_in_area(shard.bits, bounds, start, stop)
+        if level not in shard.levels:
+            # Shards without coarser time resolutions (like older ones in read only stores) are combined in memory
+            return _get_in_area(shard.bits, bounds, start, stop).reshape((-1, level)).any(axis=1)
+        return _get_in_area(shard.levels[level], bounds, start // level, stop // level)
+
+    def count(self, day_id: str, camera_id: str, start: int = 0, stop: int = definitions.TIMEFRAMES):
+        """Get the amount of time frames with motion for every cell in the time frame range [start, stop).
+
+        Whole hours are read from the hourly counts, only the remaining time frames are counted.
+        :return: None - No motion data exists for the given day and camera.
+        """
+        shard = self._open(day_id, camera_id, create=False)
+        if shard is None:
+            return None
+        if shard.heat is None:
+            return popcount_range(shard.bits, start, stop)
+        first_hour = -(-start // HOUR)
+        last_hour = stop // HOUR
+        if first_hour >= last_hour:
+            return popcount_range(shard.bits, start, stop)
+        counts = shard.heat[first_hour:last_hour].sum(axis=0, dtype=np.int64)
+        if start < first_hour * HOUR:
+            counts += popcount_range(shard.bits, start, first_hour * HOUR)
+        if last_hour * HOUR < stop:
+            counts += popcount_range(shard.bits, last_hour * HOUR, stop)
+        return counts
+
+    def set(self, day_id: str, camera_id: str, cells: NDArray[Any], index_times: NDArray[Any] | int):
+        """Save motion for the given cell indices at the given time frame indices in place."""
+        if self.read_only:
+            raise PermissionError("The motion store was opened read only.")
+        index_times = np.broadcast_to(index_times, np.shape(cells))
+        with self._lock:
+            if self._wal is not None:
+                self._wal.append(day_id, camera_id, cells, index_times)
+            self._set(day_id, camera_id, cells, index_times)
+
+    def flush(self):
+        """Write all changes to disk."""
+        with self._lock:
+            for shard in self._shards.values():
+                shard.flush()
+
+    def _set(self, day_id: str, camera_id: str, cells: NDArray[Any], index_times: NDArray[Any]):
+        shard = self._open(day_id, camera_id, create=True)
+        if shard is None:
+            return
+        if len(index_times) == 0:
+            return
+        shard.set(np.asarray(cells, dtype=np.int64), np.asarray(index_times, dtype=np.int64))
+
+    def _get_path(self, day_id: str, camera_id: str, suffix: str):
+        return self.path / day_id / f"{_get_file_name(camera_id)}{suffix}"
+
+    def _map(self, path: Path, shape: tuple[int, int], create: bool, dtype: type[np.generic] = np.uint8):
+        """Map the matrix file at the given path into memory.
+
+        :return: None - The file does not exist and should not be created.
+        """
+        if not path.exists():
+            if not create:
+                return None
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Truncating creates a sparse file, so only pages that contain motion take up disk space
+            with path.open("wb") as file:
+                file.truncate(shape[0] * shape[1] * np.dtype(dtype).itemsize)
+        mode = "r" if self.read_only else "r+"
+        return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+    def _open(self, day_id: str, camera_id: str, create: bool):
+        key = (day_id, camera_id)
+        with self._lock:
+            if (shard := self._shards.get(key, None)) is not None:
+                self._shards.move_to_end(key)
+                self._hits += 1
+                return shard
+            self._misses += 1
+            shard = self._map_shard(day_id, camera_id, create)
+            if shard is not None:
+                self._shards[key] = shard
+                self._evict()
+            return shard
+
+    def _evict(self):
+        """Unmap the least recently used shards until the cache fits into its budget."""
+        now = datetime.now(definitions.TIMEZONE)
+        pinned = {str(now.date()), str((now - timedelta(days=1)).date())}
+        size = sum(shard.size for shard in self._shards.values())
+        for key in [*self._shards]:
+            if size <= self.cache_budget:
+                return
+            if key[0] in pinned:
+                continue
+            shard = self._shards.pop(key)
+            if not self.read_only:
+                shard.flush()
+            size -= shard.size
+            self._evictions += 1
+
+    def _map_shard(self, day_id: str, camera_id: str, create: bool):
+        bits = self._map(self._get_path(day_id, camera_id, SUFFIX_BITS), SHAPE, create)
+        if bits is None:
+            return None
+        shard = _Shard(np.asarray(bits), files=[bits])
+        path_levels = self._get_path(day_id, camera_id, SUFFIX_LEVELS)
+        is_new = not path_levels.exists()
+        levels = self._map(path_levels, SHAPE_LEVELS, create=not self.read_only)
+        if levels is not None:
+            shard.files.append(levels)
+            shard.level_matrix = np.asarray(levels)
+            shard.levels = {
+                level: shard.level_matrix[:, _LEVEL_OFFSETS[index] : _LEVEL_OFFSETS[index + 1]]
+                for index, level in enumerate(LEVELS)
+            }
+            if is_new:
+                self._build_levels(shard)
+        path_heat = self._get_path(day_id, camera_id, SUFFIX_HEAT)
+        is_new = not path_heat.exists()
+        heat = self._map(path_heat, SHAPE_HEAT, create=not self.read_only, dtype=np.uint32)
+        if heat is not None:
+            shard.heat = np.asarray(heat)
+            shard.files.append(heat)
+            if is_new:
+                self._build_heat(shard)
+        return shard
+
+    @staticmethod
+    def _build_heat(shard: _Shard) -> None:
+        """Build the hourly motion counts for existing motion data, for example from older versions."""
+        if shard.heat is None or not shard.bits.any():
+            return
+        for hour in range(SHAPE_HEAT[0]):
+            shard.heat[hour] = popcount_range(shard.bits, hour * HOUR, (hour + 1) * HOUR)
+
+    @staticmethod
+    def _build_levels(shard: _Shard) -> None:
+        """Build the coarser time resolutions for existing motion data, for example from older versions."""
+        if len(shard.levels) == 0 or not shard.bits.any():
+            return
+        for cell, row in enumerate(shard.bits):
+            if not row.any():
+                continue
+            motions = unpack(row, definitions.TIMEFRAMES)
+            for level, level_bits in shard.levels.items():
+                level_bits[cell] = pack(motions.reshape((-1, level)).any(axis=1))
@@ -0,0 +1,122 @@
+"""Module that implements the write-ahead log (WAL) of the motion store.
+
+Every change to the motion store is appended to the log before it is applied to the memory-mapped files.
+The log is folded into the store by a checkpoint (see :meth:`MotionStore.checkpoint`) and replayed on startup.
+This way, no motion data is lost in case of a crash, while disk I/O only grows with the amount of new motion.
+
+The log consists of entries with the following binary layout (little endian):
+- header: day (ordinal, uint32), length of the camera ID (uint16), amount of records (uint32)
+- camera ID: UTF-8 encoded
+- records: time frame index (uint32) and bit-packed cell mask (see :const:`MASK_SIZE`)
+"""
+from __future__ import annotations
+
+import struct
+from datetime import date
+from typing import TYPE_CHECKING, Any, BinaryIO, Iterator
+
+import numpy as np
+
+from analysis import definitions
+from analysis.app_logging import logger
+from analysis.util.bits import pack, packed_size, unpack
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from numpy.typing import NDArray
+
+HEADER = struct.Struct("<IHI")
+MASK_SIZE = packed_size(definitions.CELLS)
+"""Size of a bit-packed cell mask in bytes."""
+RECORD = np.dtype([("time", "<u4"), ("mask", np.uint8, (MASK_SIZE,))])
+SUFFIX_ROTATED = ".checkpoint"
+
+Entry = tuple[str, str, "NDArray[Any]", "NDArray[Any]"]
+"""A WAL entry with the day ID, camera ID, cell indices and time frame indices."""
+
+
+def encode(day_id: str, camera_id: str, cells: NDArray[Any], index_times: NDArray[Any]):
+    """Encode the given changes into a binary WAL entry.
+
+    Changes are grouped by their time frame, so every record contains all cells of a time frame.
+    """
+    times, inverse = np.unique(index_times, return_inverse=True)
+    masks = np.zeros((len(times), definitions.CELLS), dtype=np.bool_)
+    masks[inverse, cells] = True
+    records = np.empty(len(times), dtype=RECORD)
+    records["time"] = times
+    records["mask"] = pack(masks)
+    camera = camera_id.encode()
+    header = HEADER.pack(date.fromisoformat(day_id).toordinal(), len(camera), len(records))
+    return header + camera + records.tobytes()
+
+
+def decode(file: BinaryIO) -> Iterator[Entry]:
+    """Decode all entries of the given binary WAL file.
+
+    An incomplete entry at the end of the file (for example from a crash while writing) is skipped.
+    """
+    while len(raw_header := file.read(HEADER.size)) != 0:
+        if len(raw_header) < HEADER.size:
+            logger.warning("Skipping incomplete entry at the end of the motion WAL.")
+            return
+        day, camera_length, count = HEADER.unpack(raw_header)
+        camera = file.read(camera_length)
+        raw_records = file.read(count * RECORD.itemsize)
+        if len(camera) < camera_length or len(raw_records) < count * RECORD.itemsize:
+            logger.warning("Skipping incomplete entry at the end of the motion WAL.")
+            return
+        records = np.frombuffer(raw_records, dtype=RECORD)
+        record_indices, cells = np.nonzero(unpack(records["mask"], definitions.CELLS))
+        yield str(date.fromordinal(day)), camera.decode(), cells, records["time"][record_indices]
+
+
+class WriteAheadLog:
+    """Append-only log file for motion store changes."""
+
+    def __init__(self, path: Path) -> None:
+        """Open the log at the given path for appending."""
+        self.path = path
+        self.path_rotated = path.with_name(path.name + SUFFIX_ROTATED)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("ab")
+
+    def append(self, day_id: str, camera_id: str, cells: NDArray[Any], index_times: NDArray[Any]):
+        """Append the given changes to the log.
+
+        The data is handed to the OS immediately, so it survives a crash of this process.
+        """
+        self._file.write(encode(day_id, camera_id, cells, index_times))
+        self._file.flush()
+
+    def rotate(self):
+        """Start a new log file. The previous one is kept until :meth:`discard_rotated` is called.
+
+        This uses an atomic rename, so every change is always contained in exactly one of both files.
+        If the previous log file still exists (its checkpoint failed), nothing is rotated, so it is not overwritten.
+        :return: Whether a new log file was started.
+        """
+        if self.path_rotated.exists():
+            logger.warning("The previous motion WAL was not checkpointed yet, keeping the current one.")
+            return False
+        self._file.close()
+        self.path.replace(self.path_rotated)
+        self._file = self.path.open("ab")
+        return True
+
+    def discard_rotated(self):
+        """Remove the previous log file, after its changes have been written to the store."""
+        self.path_rotated.unlink(missing_ok=True)
+
+    def close(self):
+        """Close the log file."""
+        self._file.close()
+
+    def replay(self) -> Iterator[Entry]:
+        """Get all entries from the previous and current log file, in order."""
+        for path in (self.path_rotated, self.path):
+            if not path.exists():
+                continue
+            with path.open("rb") as file:
+                yield from decode(file)
@@ -0,0 +1,135 @@
+"""Module for distributing sources to analysis worker processes.
+
+Every source has a cost, which is the amount of CPU cores that its capture and analyses need.
+Costs are measured while analyzing and saved (see :const:`analysis.definitions.PATH_COSTS`),
+isolated analyses separately from their source (see :func:`get_isolated_key`).
+Costs without a measurement are estimated with the costs of the analyses (see :attr:`Analysis.cost`).
+Sources are admitted until the machine is saturated and then packed into as few worker processes as possible,
+so lightweight sources share a process (decoding releases the GIL) while heavy ones get a core of their own.
+"""
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from analysis import definitions
+from analysis.app_logging import logger
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from analysis.vision.analyses import Analysis
+
+DECODE_COST = 0.05
+"""Estimated CPU cores that decoding a source needs, for the frame rates of the analyses."""
+WORKER_CAPACITY = 0.9
+"""How many CPU cores the sources of a worker process may use, it shares a GIL."""
+UTILIZATION = 0.8
+"""Share of the CPU cores of this machine that may be used, the rest is kept for the parent process and peaks."""
+SMOOTHING = 0.5
+"""Weight of a new measurement in the saved cost of a source (exponential moving average)."""
+
+
+@dataclass
+class Worker:
+    """Sources that are analyzed in the same worker process."""
+
+    sources: list[str] = field(default_factory=list)
+    cost: float = 0
+
+
+@dataclass
+class Plan:
+    """Distribution of sources to worker processes."""
+
+    workers: list[Worker]
+    rejected: list[str]
+    """Sources that are not admitted, as the machine would be saturated with them."""
+    costs: dict[str, float]
+    """Cost of every admitted source in its worker process."""
+
+
+def get_isolated_key(source_id: str, name: str):
+    """Get the key of the cost of the given isolated analysis of a source, as it runs in a process of its own."""
+    return f"{source_id}/{name}"
+
+
+def estimate_cost(source_id: str, analyses: dict[str, Analysis[Any]], measured: dict[str, float] | None = None):
+    """Estimate the CPU cost of the given source.
+
+    :param measured: Measured costs, which replace the estimates of isolated analyses.
+    :return: The cost in the worker process and the cost of isolated analyses, which run in processes of their own.
+    """
+    measured = measured or {}
+    used = {
+        name: analysis
+        for name, analysis in analyses.items()
+        if analysis.is_used is None or analysis.is_used(source_id)
+    }
+    cost = DECODE_COST + sum(analysis.cost for analysis in used.values() if not analysis.isolated)
+    isolated_cost = sum(
+        measured.get(get_isolated_key(source_id, name), analysis.cost)
+        for name, analysis in used.items()
+        if analysis.isolated
+    )
+    return cost, isolated_cost
+
+
+def schedule(
+    source_ids: list[str],
+    analyses: dict[str, Analysis[Any]],
+    measured: dict[str, float],
+    cores: float | None = None,
+):
+    """Admit the given sources (in order) while the machine has capacity and pack them into worker processes.
+
+    This uses first fit decreasing bin packing, with the capacity of a worker process as bin size.
+    :param measured: Measured costs of sources in their worker process and of isolated analyses.
+    Estimates are used for missing measurements.
+    :param cores: Amount of CPU cores. All cores of this machine by default, infinite to admit all sources.
+    """
+    capacity = (cores if cores is not None else os.cpu_count() or 1) * UTILIZATION
+    costs: dict[str, float] = {}
+    rejected: list[str] = []
+    total = 0.0
+    for source_id in source_ids:
+        cost, isolated_cost = estimate_cost(source_id, analyses, measured)
+        cost = measured.get(source_id, cost)
+        if total + cost + isolated_cost > capacity:
+            rejected.append(source_id)
+            continue
+        total += cost + isolated_cost
+        costs[source_id] = cost
+    workers: list[Worker] = []
+    for source_id in sorted(costs, key=costs.__getitem__, reverse=True):
+        cost = costs[source_id]
+        worker = next((worker for worker in workers if worker.cost + cost <= WORKER_CAPACITY), None)
+        if worker is None:
+            worker = Worker()
+            workers.append(worker)
+        worker.sources.append(source_id)
+        worker.cost += cost
+    return Plan(workers, rejected, costs)
+
+
+def load_costs(path: Path = definitions.PATH_COSTS) -> dict[str, float]:
+    """Load the measured costs of the sources. Returns no costs if there are no valid measurements."""
+    if not path.exists():
+        return {}
+    try:
+        return {source_id: float(cost) for source_id, cost in json.loads(path.read_text()).items()}
+    except (ValueError, AttributeError):
+        logger.warning(f'Ignoring invalid source costs at "{path}".')
+        return {}
+
+
+def save_costs(costs: dict[str, float], measured: dict[str, float], path: Path = definitions.PATH_COSTS):
+    """Save the given measurements, combined with the previous costs."""
+    updated = costs.copy()
+    for source_id, cost in measured.items():
+        previous = costs.get(source_id)
+        updated[source_id] = cost if previous is None else SMOOTHING * cost + (1 - SMOOTHING) * previous
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(updated, indent=2))
@@ -107,7 +107,7 @@ def shelf_stream(
     logger.info("Starting")
     results = analyze_shelf(from_capture(capture, Event()), crop_like, visualize=True)
     if results is not None:
-        results.subscribe(lambda result: parse_shelf_result(result, crop_like), logger.exception)
+        results.subscribe(lambda result: parse_shelf_result(result[0], crop_like), logger.exception)
 
 
 if __name__ == "__main__":
@@ -3,35 +3,60 @@
 # ruff: noqa: FA100
 from logging import WARN, getLogger
 
-from cv2.typing import MatLike
-from reactivex import Observable, concat, repeat_value
+import cv2
+import numpy as np
+from reactivex import Observable
 from reactivex import operators as ops
 
 from analysis.app_logging import logger
-from analysis.definitions import PATH_SETTINGS
+from analysis.definitions import GRID_SIZE, PATH_SETTINGS
 from analysis.types_adeck import settings
+from analysis.util.frames import Frame
+from analysis.util.metrics import STAGE_METRIC, timer
+from analysis.util.rx import THROTTLE_TOLERANCE
 from analysis.vision.shelf_monitoring.models import Model, models
 
-monitoring_settings = settings.load(PATH_SETTINGS).shelf_monitoring
+loaded_settings = settings.load(PATH_SETTINGS)
+monitoring_settings = loaded_settings.shelf_monitoring
+monitoring_stream = loaded_settings.shelf_monitoring_stream
+"""Stream of the cameras that is used for shelf monitoring. The configured points are pixels of its frames."""
 
-FPS = 25
-"""The FPS of the input video. This is static for the used IP cameras but could also be parsed from the input stream."""
 MEMORY_TIME = 60
-"""How long to memorize gaps."""
+"""How long (in seconds of capture time) to memorize gaps."""
 TIME_PER_FRAME = 1
-"""How long to wait between analyses."""
-N = int(FPS * TIME_PER_FRAME)
-"""How many frames to skip + 1."""
+"""Shortest time between analyses. Frames are only analyzed after motion, so the time between them may be longer."""
 MEMORIZED_FRAME_COUNT = int(MEMORY_TIME / TIME_PER_FRAME)
-"""How many frames/analysis results to save."""
+"""Highest amount of analysis results that are memorized, when a frame is analyzed every time frame."""
+
+
+def is_monitored(source_id: str):
+    """Check whether shelf monitoring is configured for the given source."""
+    return source_id in monitoring_settings
+
+
+def get_shelf_cells(source_id: str, size: tuple[int, int]):
+    """Get the grid cells that overlap the monitored shelf of the given source, for frames of the given size."""
+    points = monitoring_settings.get(source_id, None)
+    if points is None:
+        return None
+    height, width = size
+    rows, columns = GRID_SIZE
+    mask = np.zeros(size, dtype=np.uint8)
+    cv2.fillPoly(mask, [np.array(points, dtype=np.int32)], 1)
+    cell_height, cell_width = height // rows, width // columns
+    cells = mask[: rows * cell_height, : columns * cell_width].reshape(rows, cell_height, columns, cell_width)
+    return cells.any(axis=(1, 3))
 
 
 def analyze_shelf(
-    frames: Observable[MatLike],
+    frames: Observable[Frame],
     source_id: str,
     visualize: bool,
 ):
-    """Analyze frames from given observable with shelf monitoring."""
+    """Analyze frames from given observable with shelf monitoring.
+
+    :return: Observable of whether there is a new gap, with the capture time of the frame.
+    """
     # Get warping bound points for this stream, if configured
     points = monitoring_settings.get(source_id, None)
     if points is None:
@@ -39,6 +64,7 @@ def analyze_shelf(
     logger.info(f'Starting shelf monitoring for "{source_id}"')
 
     from ultralytics import YOLO
+    from ultralytics.engine.results import Results
 
     from analysis.util.image import show, warp
     from analysis.util.yolov8 import plot, predict
@@ -49,25 +75,28 @@ def analyze_shelf(
 
     model = YOLO(models[Model.sku_gap]["path"])
 
-    def analyze_frame(image: MatLike):
+    def analyze_frame(frame: Frame):
+        image = frame.image
         if points is not None:
             image = warp(image, points)
-        results = predict(model, image, classes=[1])
+        with timer(STAGE_METRIC, source=source_id, stage="predict"):
+            results = predict(model, image, classes=[1])
         if visualize:
             show(plot(results[0], labels=True, line_width=1), fps=7)
-        return results
+        return results, frame.time
 
-    result_stream = frames.pipe(
-        # Get analysis results for every n-th frame
-        ops.buffer_with_count(N),
-        # Return only the last frame
-        ops.map(lambda images: images[-1]),
+    def memorize(memory: list[tuple[list[Results], float]], result: tuple[list[Results], float]):
+        # Keep the results whose frames were captured within the memory time before the newest one
+        _, time = result
+        return [*(entry for entry in memory[-MEMORIZED_FRAME_COUNT + 1 :] if time - entry[1] < MEMORY_TIME), result]
+
+    return frames.pipe(
+        # Get analysis results for one frame per time frame
+        ops.throttle_first(TIME_PER_FRAME * THROTTLE_TOLERANCE),
         ops.map(analyze_frame),
-    )
-    return concat(repeat_value(None, MEMORIZED_FRAME_COUNT), result_stream).pipe(
         # Emit all previous results as well
-        ops.buffer_with_count(MEMORIZED_FRAME_COUNT - 1, 1),
-        ops.map(has_new_gap),
+        ops.scan(memorize, []),
+        ops.map(lambda memory: (has_new_gap([results for results, _ in memory]), memory[-1][1])),
     )
 
 
@@ -0,0 +1,133 @@
+"""Module for keeping the capture of a source running.
+
+Streams of IP cameras fail from time to time (network issues, camera reboots) or freeze.
+The supervisor reopens the capture with an exponential backoff, while the analyses of the source keep running.
+This way, neither processes nor models have to be set up again.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Callable
+
+import cv2
+from cv2 import VideoCapture
+
+from analysis.app_logging import logger
+from analysis.util.metrics import registry
+from analysis.util.rx import read_frames
+
+if TYPE_CHECKING:
+    from analysis.util.frames import Frame
+
+OPEN_TIMEOUT = 10
+"""How long to wait for a stream to open (in seconds)."""
+READ_TIMEOUT = 10
+"""How long to wait for a frame of an opened stream (in seconds)."""
+STALL_TIMEOUT = 10
+"""How long the timestamps of the frames of a stream may stay the same until it is considered frozen (in seconds)."""
+BACKOFF_START = 1
+"""How long to wait before the first attempt to reopen a failed stream (in seconds)."""
+BACKOFF_MAX = 60
+"""Longest time to wait between attempts to reopen a failed stream (in seconds).
+
+The backoff starts over when a stream has been running for this long.
+"""
+
+
+@dataclass
+class CaptureHealth:
+    """Restart statistics of the capture of a source."""
+
+    restarts: int = 0
+    downtime: float = 0
+    """Total time in seconds that the capture was not running, since it was first opened."""
+    down_since: float | None = None
+    """Monotonic time when the capture went down. None while it is running."""
+
+
+health: dict[str, CaptureHealth] = {}
+"""Restart statistics of the sources that are captured in this process."""
+
+
+def open_capture(source: str):
+    """Open the given source with the FFmpeg backend, with timeouts for opening and reading."""
+    return VideoCapture(
+        source,
+        cv2.CAP_FFMPEG,
+        [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,
+            OPEN_TIMEOUT * 1000,
+            cv2.CAP_PROP_READ_TIMEOUT_MSEC,
+            READ_TIMEOUT * 1000,
+        ],
+    )
+
+
+class CaptureSupervisor:
+    """Supervisor that (re)opens the capture of a source and reads from it until it should stop."""
+
+    def __init__(self, source: str, source_id: str, should_stop: Callable[[], bool]) -> None:
+        """Create a supervisor for the given source."""
+        self.source = source
+        self.source_id = source_id
+        self.should_stop = should_stop
+        # Files end instead of failing, they are not reopened
+        self.is_file = Path(source).is_file()
+        self.health = health.setdefault(source_id, CaptureHealth())
+        self._backoff = BACKOFF_START
+
+    def open(self) -> VideoCapture | None:
+        """Open the capture, retrying with an exponential backoff.
+
+        :return: The opened capture. None if the supervisor should stop before the capture could be opened.
+        """
+        while not self.should_stop():
+            capture = open_capture(self.source)
+            if capture.isOpened():
+                logger.debug(f'Video capture opened for source "{self.source_id}". Backend: {capture.getBackendName()}')
+                if self.health.down_since is not None:
+                    downtime = monotonic() - self.health.down_since
+                    self.health.downtime += downtime
+                    self.health.down_since = None
+                    registry.increment("capture_downtime_seconds_total", downtime, source=self.source_id)
+                    logger.info(
+                        f'Source "{self.source_id}" is running again (restarts: {self.health.restarts}, '
+                        f"downtime: {self.health.downtime:.0f}s).",
+                    )
+                return capture
+            capture.release()
+            logger.warning(f'Could not open source "{self.source_id}", retrying in {self._backoff}s.')
+            self._wait_backoff()
+        return None
+
+    def run(self, capture: VideoCapture, on_frame: Callable[[Frame], None], fps: float | None = None):
+        """Read frames from the given capture. Reopen it if it fails or stalls, until the supervisor should stop.
+
+        :param fps: See :func:`read_frames`.
+        """
+        while True:
+            opened = monotonic()
+            read_frames(capture, on_frame, self.should_stop, fps, STALL_TIMEOUT, self.source_id)
+            capture.release()
+            if self.should_stop() or self.is_file:
+                return
+            if monotonic() - opened >= BACKOFF_MAX:
+                self._backoff = BACKOFF_START
+            self.health.restarts += 1
+            registry.increment("capture_restarts_total", source=self.source_id)
+            self.health.down_since = monotonic()
+            logger.warning(f'Capture of source "{self.source_id}" failed, reopening in {self._backoff}s.')
+            self._wait_backoff()
+            reopened = self.open()
+            if reopened is None:
+                return
+            capture = reopened
+
+    def _wait_backoff(self):
+        """Wait for the current backoff time (or until the supervisor should stop) and double it."""
+        end = monotonic() + self._backoff
+        while not self.should_stop() and (remaining := end - monotonic()) > 0:
+            sleep(min(remaining, 1))
+        self._backoff = min(self._backoff * 2, BACKOFF_MAX)
@@ -0,0 +1,146 @@
+"""Module for sending analysis results from the capture processes to the parent process.
+
+Results are collected over a time window (see :const:`analysis.definitions.RESULT_WINDOW`)
+and sent as a single binary message, which saves pickling and pipe syscalls for every result.
+Analyses can define a compact binary representation for their results (see :attr:`Analysis.pack`),
+other results are pickled as a list. Snapshots of the metrics of the process are sent periodically
+in the :const:`METRICS` section (see :module:`analysis.util.metrics`).
+
+A message consists of a section for every analysis with results, with the following layout (little endian):
+- header: length of the analysis name (uint8), amount of results (uint32), payload size (uint32)
+- analysis name: UTF-8 encoded
+- times: capture time (UNIX timestamp, float64) of every result
+- payload: packed or pickled results
+"""
+from __future__ import annotations
+
+import os
+import pickle
+import struct
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+from analysis import definitions
+from analysis.app_logging import logger
+from analysis.util.metrics import registry
+
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+
+    from numpy.typing import NDArray
+
+    from analysis.vision.analyses import Analysis
+
+HEADER = struct.Struct("<BII")
+TIME = np.dtype("<f8")
+METRICS = "_metrics"
+"""Name of the message section with metric snapshots (with the ID of their process)."""
+METRICS_INTERVAL = 10
+"""How often to send a snapshot of the metrics of a process (in seconds)."""
+
+Batch = tuple["NDArray[np.float64]", list[Any]]
+"""Times and results of an analysis."""
+
+
+def encode(batches: dict[str, tuple[list[float], list[Any]]], analyses: dict[str, Analysis[Any]]):
+    """Encode the given results (with their times) of every analysis into a binary message."""
+    sections: list[bytes] = []
+    for name, (times, results) in batches.items():
+        pack = analyses[name].pack if name in analyses else None
+        payload = pack(results) if pack is not None else pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+        encoded_name = name.encode()
+        header = HEADER.pack(len(encoded_name), len(results), len(payload))
+        sections.extend((header, encoded_name, np.asarray(times, dtype=TIME).tobytes(), payload))
+    return b"".join(sections)
+
+
+def decode(message: bytes, analyses: dict[str, Analysis[Any]]) -> dict[str, Batch]:
+    """Decode the results of every analysis from the given binary message."""
+    batches: dict[str, Batch] = {}
+    view = memoryview(message)
+    offset = 0
+    while offset < len(view):
+        name_length, count, payload_size = HEADER.unpack_from(view, offset)
+        offset += HEADER.size
+        name = bytes(view[offset : offset + name_length]).decode()
+        offset += name_length
+        times = np.frombuffer(view, dtype=TIME, count=count, offset=offset)
+        offset += count * TIME.itemsize
+        payload = view[offset : offset + payload_size]
+        offset += payload_size
+        unpack = analyses[name].unpack if name in analyses else None
+        results = list(unpack(bytes(payload))) if unpack is not None else pickle.loads(payload)  # noqa: S301
+        batches[name] = (times, results)
+    return batches
+
+
+class ResultSender:
+    """Sender that collects analysis results over a time window and sends them as a single binary message.
+
+    Results can be sent from multiple threads. This also sends snapshots of the metrics of this process.
+    """
+
+    def __init__(
+        self,
+        connection: Connection,
+        analyses: dict[str, Analysis[Any]],
+        window: float = definitions.RESULT_WINDOW,
+    ) -> None:
+        """Start sending over the given connection, every given amount of seconds."""
+        self._connection = connection
+        self._analyses = analyses
+        self._window = window
+        self._batches: dict[str, tuple[list[float], list[Any]]] = {}
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self._next_metrics = monotonic()
+        self._closed = Event()
+        self._thread = Thread(target=self._run, name="ResultSender", daemon=True)
+        self._thread.start()
+
+    def send(self, output: tuple[str, Any], timestamp: float | None = None):
+        """Add the given result (with the name of its analysis) to the next message.
+
+        :param timestamp: UNIX time at which the frame of the result was captured. Now by default.
+        """
+        name, result = output
+        with self._lock:
+            times, results = self._batches.setdefault(name, ([], []))
+            times.append(time() if timestamp is None else timestamp)
+            results.append(result)
+
+    def forward(self, message: bytes):
+        """Send the given message (for example from the sender of another process) as it is."""
+        try:
+            with self._send_lock:
+                self._connection.send_bytes(message)
+        except (BrokenPipeError, OSError):
+            logger.exception("Could not forward analysis results to the parent process.")
+
+    def flush(self, metrics: bool = False):
+        """Send all collected results now.
+
+        :param metrics: Whether to send a snapshot of the metrics, even if it is not due yet.
+        """
+        with self._lock:
+            batches = self._batches
+            self._batches = {}
+        if metrics or monotonic() >= self._next_metrics:
+            self._next_metrics = monotonic() + METRICS_INTERVAL
+            batches[METRICS] = ([time()], [(str(os.getpid()), registry.snapshot())])
+        if len(batches) == 0:
+            return
+        self.forward(encode(batches, self._analyses))
+
+    def close(self):
+        """Send the remaining results and a last metrics snapshot and stop sending."""
+        self._closed.set()
+        self._thread.join()
+        self.flush(metrics=True)
+
+    def _run(self):
+        while not self._closed.wait(self._window):
+            self.flush()
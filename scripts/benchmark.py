@@ -0,0 +1,315 @@
+"""Module for benchmarking the hot paths of the vision analyses and the motion store.
+
+Every stage is run on synthetic data (frames in 720p and 1080p, random motion and gap detections),
+so the results only depend on the code and the hardware. OpenCL is disabled by default, so results
+of CPU-only machines can be compared. The results are written as JSON, to track regressions between commits.
+
+The motion engines can also be compared on recorded samples, for their CPU time and the share of cells
+that they detect motion in (see the `engines` command).
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+from itertools import cycle
+from pathlib import Path
+from statistics import fmean, median, stdev
+from tempfile import TemporaryDirectory
+from time import process_time
+from timeit import Timer
+from typing import Annotated, Any, Callable, Iterator, Optional
+
+import cv2
+import numpy as np
+import rich
+from rich.console import Console
+from typer import Argument, Option, Typer
+
+from analysis import definitions, state
+from analysis.util.image import draw_overlay, warp
+from analysis.util.rx import get_stream_fps, sample
+from analysis.vision.motion_search import motion
+from analysis.vision.motion_search.engines import Engine, create_engine
+from analysis.vision.motion_search.motion import (
+    _get_changes,  # pyright: ignore[reportPrivateUsage]
+    analyze_diff,
+    prepare,
+    update_global_matrices,
+    update_global_matrix,
+)
+from analysis.vision.motion_search.read import calculate_heatmap, get_motions_in_area
+from analysis.vision.motion_search.store import MotionStore
+
+app = Typer(help="Benchmark the stages of the analyses and the motion store.")
+console = Console(stderr=True)
+
+SIZES = {"720p": (720, 1280), "1080p": (1080, 1920)}
+"""Frame sizes (height, width) to run the vision stages with."""
+SHELF = ((0.44, 0.14), (0.99, 0.4), (0.86, 0.87), (0.44, 0.58))
+"""Corners of a shelf to warp, relative to the frame size (like in the settings file)."""
+CAMERA_ID = "benchmark"
+MOTION_DENSITY = 0.1
+"""Share of the seconds of the benchmarked day with motion."""
+BATCH_SIZE = 100
+GAP_COUNT = 20
+"""Amount of detected gaps in every shelf monitoring result."""
+WARMUP_FRAMES = 50
+"""Amount of frames of every sample that the engines may learn from, before they are measured."""
+
+Case = tuple[str, str | None, Callable[[], Any]]
+"""Name of a stage, the frame size (if it works on frames) and a function that runs the stage once."""
+
+
+def _create_frames(height: int, width: int):
+    """Create two noisy frames with a moving rectangle."""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for offset in (0, width // 20):
+        frame = background.copy()
+        top_left, bottom_right = (width // 4 + offset, height // 4), (width // 2 + offset, height // 2)
+        cv2.rectangle(frame, top_left, bottom_right, (255, 255, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def _vision_cases() -> Iterator[Case]:
+    for label, (height, width) in SIZES.items():
+        reference, frame = _create_frames(height, width)
+        _, prepared_reference = prepare(reference)
+        original, prepared = prepare(frame)
+        _, _, _, change_matrix = analyze_diff(original, prepared, prepared_reference)
+        _, threshold_diff = cv2.threshold(cv2.absdiff(prepared_reference, prepared), 30, 255, cv2.THRESH_BINARY)
+        diff = threshold_diff.get()
+        # The overlay is drawn into the given image
+        canvas = frame.copy()
+        shelf = tuple((int(x * width), int(y * height)) for x, y in SHELF)
+        yield "prepare", label, lambda frame=frame: prepare(frame)
+        yield (
+            "analyze_diff",
+            label,
+            lambda original=original, prepared=prepared, reference=prepared_reference: analyze_diff(
+                original,
+                prepared,
+                reference,
+            ),
+        )
+        yield "_get_changes", label, lambda diff=diff: _get_changes(diff, definitions.GRID_SIZE)
+        yield "draw_overlay", label, lambda canvas=canvas, matrix=change_matrix: draw_overlay(canvas, matrix)
+        yield "warp", label, lambda frame=frame, shelf=shelf: warp(frame, shelf)  # pyright: ignore[reportArgumentType]
+
+
+def _engine_cases() -> Iterator[Case]:
+    width, height = motion.RESOLUTION
+    frames = _create_frames(height, width)
+    for engine in Engine:
+        detector = create_engine(engine)
+        # Alternate between the frames, so every run detects motion
+        next_frame = cycle(frames).__next__
+        detector.detect(next_frame())
+        yield (
+            f"detect ({engine.value})",
+            f"{height}p",
+            lambda detector=detector, next_frame=next_frame: detector.detect(next_frame()),
+        )
+
+
+def _gap_cases() -> Iterator[Case]:
+    try:
+        import torch
+        from ultralytics.engine.results import Results
+
+        from analysis.vision.shelf_monitoring.gaps import MEMORIZED_FRAME_COUNT
+        from analysis.vision.shelf_monitoring.removal import has_new_gap
+    except ImportError as error:
+        console.print(f"Skipping shelf monitoring stages, as {error.name} is not installed.")
+        return
+    height, width = SIZES["1080p"]
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    generator = torch.Generator().manual_seed(0)
+
+    def create_result():
+        corners = torch.rand((GAP_COUNT, 2), generator=generator) * torch.tensor([width - 100, height - 100])
+        sizes = 20 + torch.rand((GAP_COUNT, 2), generator=generator) * 80
+        boxes = torch.cat((corners, corners + sizes, torch.full((GAP_COUNT, 1), 0.9), torch.ones((GAP_COUNT, 1))), 1)
+        return [Results(image, "", {0: "product", 1: "gap"}, boxes=boxes)]
+
+    results = [create_result() for _ in range(MEMORIZED_FRAME_COUNT)]
+    yield "has_new_gap", None, lambda: has_new_gap(results)
+
+
+def _store_cases(directory: Path) -> Iterator[Case]:
+    state.motions = MotionStore(directory / "motions")
+    rng = np.random.default_rng(0)
+    now = datetime.now(definitions.TIMEZONE)
+    day_id = str(now.date())
+    # Fill the benchmarked day, so queries read a realistic amount of data
+    index_times = np.flatnonzero(rng.random(definitions.TIMEFRAMES) < MOTION_DENSITY)
+    cells = rng.integers(0, definitions.CELLS, len(index_times))
+    state.motions.set(day_id, CAMERA_ID, cells, index_times)
+    matrices = rng.random((BATCH_SIZE, *definitions.GRID_SIZE)) < MOTION_DENSITY
+    changes = [(matrix, CAMERA_ID, now) for matrix in matrices]
+    yield "update_global_matrix", None, lambda: update_global_matrix(matrices[0], CAMERA_ID)
+    yield f"update_global_matrices ({BATCH_SIZE})", None, lambda: update_global_matrices(changes)
+    yield "get_motions_in_area", None, lambda: get_motions_in_area(state.motions, CAMERA_ID, [4, 2, 8, 5], day_id)
+    yield "calculate_heatmap", None, lambda: calculate_heatmap(CAMERA_ID)
+
+
+def _measure(name: str, size: str | None, function: Callable[[], Any], repeat: int):
+    """Measure the duration of a single run of the given function (in seconds)."""
+    timer = Timer(function)
+    # Every measurement runs the function often enough to last at least 0.2 seconds
+    number, _ = timer.autorange()
+    durations = [duration / number for duration in timer.repeat(repeat, number)]
+    result = {
+        "name": name,
+        "size": size,
+        "number": number,
+        "repeat": repeat,
+        "min": min(durations),
+        "median": median(durations),
+        "mean": fmean(durations),
+        "stdev": stdev(durations) if repeat > 1 else 0.0,
+    }
+    console.print(f"{name}{f' ({size})' if size is not None else ''}: {result['median'] * 1000:.3f}ms")
+    return result
+
+
+def _get_commit():
+    try:
+        command = ["git", "rev-parse", "HEAD"]
+        result = subprocess.run(command, capture_output=True, check=True, text=True)  # noqa: S603
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip()
+
+
+def _get_environment(opencl: bool):
+    return {
+        "commit": _get_commit(),
+        "time": datetime.now(definitions.TIMEZONE).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencl": opencl,
+    }
+
+
+@app.command()
+def run(
+    output: Annotated[
+        Optional[Path],  # noqa: UP007
+        Option(help="JSON file to write the results to. Printed if not given."),
+    ] = None,
+    repeat: Annotated[int, Option(help="How often to measure every stage.")] = 5,
+    opencl: Annotated[bool, Option(help="Whether OpenCV may use OpenCL (the GPU).")] = False,
+):
+    """Benchmark every stage and report the duration of a single run in seconds."""
+    cv2.ocl.setUseOpenCL(opencl)
+    with TemporaryDirectory() as directory:
+        cases = [*_vision_cases(), *_engine_cases(), *_gap_cases(), *_store_cases(Path(directory))]
+        results = [_measure(name, size, function, repeat) for name, size, function in cases]
+        state.motions.close()
+    report = json.dumps({"environment": _get_environment(cv2.ocl.useOpenCL()), "results": results}, indent=2)
+    if output is None:
+        rich.print_json(report)
+    else:
+        output.write_text(report)
+
+
+def _measure_engine(engine: Engine, path: Path, warmup: int):
+    """Run the given engine on a recorded sample, like the live analysis does.
+
+    :return: The CPU time of every measured frame (in seconds) and the amount of cells with motion in them.
+    """
+    capture = cv2.VideoCapture(str(path))
+    if not capture.isOpened():
+        msg = f'Could not open the sample "{path}".'
+        raise ValueError(msg)
+    detector = create_engine(engine)
+    durations: list[float] = []
+    cells: list[int] = []
+    for needed in sample(get_stream_fps(capture), motion.FPS):
+        success, frame = capture.read()
+        if not success:
+            break
+        if not needed:
+            continue
+        frame = cv2.resize(frame, motion.RESOLUTION, interpolation=cv2.INTER_AREA)
+        start = process_time()
+        detection = detector.detect(frame)
+        duration = process_time() - start
+        if detection is None or warmup > 0:
+            warmup -= 1
+            continue
+        durations.append(duration)
+        cells.append(int(detection.change_matrix.sum()))
+    capture.release()
+    return durations, cells
+
+
+def _get_cell_rate(cells: list[int]):
+    """Get the share of cells with motion in them, over all frames."""
+    return sum(cells) / (len(cells) * definitions.CELLS) if len(cells) > 0 else None
+
+
+@app.command()
+def engines(
+    still: Annotated[
+        list[Path],
+        Argument(help="Recorded samples without motion, every cell with motion in them is a false positive."),
+    ],
+    moving: Annotated[
+        Optional[list[Path]],  # noqa: UP007
+        Option(help="Recorded samples with motion, to compare how much of it the engines detect."),
+    ] = None,
+    warmup: Annotated[int, Option(help="Frames of every sample to skip, while the engines learn.")] = WARMUP_FRAMES,
+    output: Annotated[
+        Optional[Path],  # noqa: UP007
+        Option(help="JSON file to write the results to. Printed if not given."),
+    ] = None,
+    opencl: Annotated[bool, Option(help="Whether OpenCV may use OpenCL (the GPU).")] = False,
+):
+    """Compare the motion engines on recorded samples, for their CPU time per frame and false positive cells.
+
+    The samples are analyzed at the frame rate and resolution of the live analysis.
+    """
+    cv2.ocl.setUseOpenCL(opencl)
+    results = []
+    for engine in Engine:
+        durations: list[float] = []
+        still_cells: list[int] = []
+        moving_cells: list[int] = []
+        for paths, cells in ((still, still_cells), (moving or [], moving_cells)):
+            for path in paths:
+                sample_durations, sample_cells = _measure_engine(engine, path, warmup)
+                durations.extend(sample_durations)
+                cells.extend(sample_cells)
+        result = {
+            "engine": engine.value,
+            "frames": len(durations),
+            "cpu_per_frame": fmean(durations) if len(durations) > 0 else None,
+            "cpu_per_frame_median": median(durations) if len(durations) > 0 else None,
+            "false_positive_cell_rate": _get_cell_rate(still_cells),
+            "moving_cell_rate": _get_cell_rate(moving_cells),
+        }
+        results.append(result)
+        console.print(
+            f"{engine.value}: {(result['cpu_per_frame'] or 0) * 1000:.3f}ms CPU per frame, "
+            f"false positive cells: {result['false_positive_cell_rate']}",
+        )
+    report = json.dumps({"environment": _get_environment(cv2.ocl.useOpenCL()), "results": results}, indent=2)
+    if output is None:
+        rich.print_json(report)
+    else:
+        output.write_text(report)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,295 @@
+"""Module for finding out how many cameras this machine can analyze, with simulated cameras.
+
+A video file is published in a loop as RTSP streams, one for every simulated camera (with ffmpeg).
+This needs an RTSP server that accepts published streams, for example mediamtx (https://github.com/bluenviron/mediamtx).
+The file should be encoded like the camera streams (H.264), as it is not transcoded.
+
+For every combination of analyses, the amount of cameras is increased step by step. Every step runs the
+real analysis (see :func:`analysis.vision.capture.analyze_sources`) in a process of its own and measures
+the CPU usage and memory of that process tree, as well as the frame rate and lag of the results per camera.
+A step is sustainable if every analysis keeps its frame rate and lag for every camera.
+Linux only, as the usage of the processes is read from `/proc`.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import subprocess
+from asyncio import sleep
+from multiprocessing import Pipe, get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic
+from typing import TYPE_CHECKING, Annotated, Any, Optional
+
+import cv2
+import rich
+from rich.console import Console
+from rich.table import Table
+from typer import Argument, Option, Typer
+
+from analysis import state
+from analysis.app_logging import logger
+from analysis.util.metrics import BUCKETS, LAG_METRIC, Snapshot, registry
+from analysis.util.tasks import create_task, loop
+from analysis.vision.analyses import analyses
+from analysis.vision.capture import analyze_sources
+from analysis.vision.motion_search.store import MotionStore
+from analysis.vision.shelf_monitoring.gaps import monitoring_settings
+
+if TYPE_CHECKING:
+    from multiprocessing.connection import Connection
+
+app = Typer(help="Find out how many cameras this machine can analyze.")
+console = Console(stderr=True)
+
+PUBLISH_DELAY = 3
+"""How long to wait for newly published streams to be available on the RTSP server (in seconds)."""
+FPS_TOLERANCE = 0.9
+"""Share of the frame rate of an analysis that it has to reach for every camera."""
+SHELF = ((0.3, 0.2), (0.7, 0.2), (0.7, 0.8), (0.3, 0.8))
+"""Corners of the shelf that is monitored in the simulated cameras, relative to the frame size."""
+WEIGHTS = Path("weights")
+
+
+def _get_usage(pid: int):
+    """Get the CPU time (in seconds) and the resident memory (in bytes) of a process with all its descendants."""
+    children: dict[int, list[int]] = {}
+    stats: dict[int, list[str]] = {}
+    for path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            text = path.read_text()
+        except OSError:
+            # The process has ended
+            continue
+        # The name of the process is in parentheses and may contain spaces, see `man proc`
+        fields = text[text.rindex(")") + 2 :].split()
+        stats[int(path.parent.name)] = fields
+        children.setdefault(int(fields[1]), []).append(int(path.parent.name))
+    cpu, rss = 0.0, 0
+    pending = [pid]
+    while len(pending) > 0:
+        current = pending.pop()
+        if current in stats:
+            fields = stats[current]
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        pending.extend(children.get(current, []))
+    return cpu, rss
+
+
+def _get_quantile(counts: list[int], quantile: float) -> float | None:
+    """Get the upper bound of the histogram bucket that contains the given quantile. None if it is unbounded."""
+    total = sum(counts)
+    cumulative = 0
+    # The last bucket has no upper bound
+    for bound, count in zip((*BUCKETS, None), counts, strict=True):
+        cumulative += count
+        if cumulative >= quantile * total:
+            return bound
+    return None
+
+
+def _get_rates(start: Snapshot, end: Snapshot, duration: float, source_ids: list[str], names: list[str]):
+    """Get the result rate and lag of every analysis for every source between the given metric snapshots."""
+    rates: dict[str, dict[str, dict[str, float | None]]] = {}
+    for source_id in source_ids:
+        for name in names:
+            key = (LAG_METRIC, (("source", source_id), ("analysis", name)))
+            end_counts, end_total = end[1].get(key) or ([0] * (len(BUCKETS) + 1), 0.0)
+            start_counts, start_total = start[1].get(key) or ([0] * (len(BUCKETS) + 1), 0.0)
+            counts = [after - before for after, before in zip(end_counts, start_counts, strict=True)]
+            count = sum(counts)
+            rates.setdefault(source_id, {})[name] = {
+                "fps": count / duration,
+                "lag_mean": float(end_total - start_total) / count if count > 0 else None,
+                "lag_p95": _get_quantile(counts, 0.95) if count > 0 else None,
+            }
+    return rates
+
+
+async def _measure(sources: dict[str, str], names: list[str], warmup: float, duration: float, costs_path: Path):
+    """Analyze the given sources and measure the usage and the results after the warmup.
+
+    All sources are admitted (the step is meant to saturate this machine),
+    their costs are saved to the given file instead of with those of the real cameras.
+    """
+    analysis = analyze_sources(dict(sources), costs_path=costs_path, cores=math.inf)
+    task = create_task(analysis, "Analysis main task", logger, print_exceptions=True)
+    await sleep(warmup)
+    start_cpu, _ = _get_usage(os.getpid())
+    start_metrics, start = registry.snapshot(), monotonic()
+    await sleep(duration)
+    end_cpu, rss = _get_usage(os.getpid())
+    end_metrics, end = registry.snapshot(), monotonic()
+    state.terminating.set()
+    await task
+    return {
+        "cpu_cores": (end_cpu - start_cpu) / (end - start),
+        "rss_bytes": rss,
+        "sources": _get_rates(start_metrics, end_metrics, end - start, list(sources), names),
+    }
+
+
+def _write_settings(directory: Path, source_ids: list[str], size: tuple[int, int]):
+    """Write a settings file that monitors a shelf in every simulated camera, and use it in this process."""
+    height, width = size
+    points = [(int(x * width), int(y * height)) for x, y in SHELF]
+    lines = ["excludes = []", 'shelf_monitoring_stream = "sd"', "", "[shelf_monitoring]"]
+    lines.extend(f'"{source_id}" = {json.dumps(points)}' for source_id in source_ids)
+    (directory / "settings.toml").write_text("\n".join(lines) + "\n")
+    # The settings of this process were loaded before
+    monitoring_settings.update(dict.fromkeys(source_ids, points))
+
+
+def _run_step(  # noqa: PLR0913 all parameters are needed for the step
+    sources: dict[str, str],
+    names: list[str],
+    size: tuple[int, int],
+    warmup: float,
+    duration: float,
+    connection: Connection,
+):
+    """Analyze the given sources with the given analyses in this process and send the measurements.
+
+    This runs in a directory with generated settings, so shelf monitoring is used for the simulated cameras
+    (also in the processes of isolated analyses, which load the settings on their own).
+    The motion and the costs of the sources are saved in that directory.
+    """
+    weights = WEIGHTS.resolve()
+    with TemporaryDirectory() as directory:
+        _write_settings(Path(directory), list(sources), size)
+        if weights.exists():
+            (Path(directory) / WEIGHTS).symlink_to(weights)
+        os.chdir(directory)
+        for name in [name for name in analyses if name not in names]:
+            del analyses[name]
+        state.motions = MotionStore(Path(directory) / "motions")
+        try:
+            measure = _measure(sources, names, warmup, duration, Path(directory) / "costs.json")
+            connection.send(loop.run_until_complete(measure))
+        finally:
+            state.motions.close()
+
+
+def _is_sustainable(result: dict[str, Any], names: list[str], max_lag: float):
+    """Check whether every analysis keeps its frame rate and lag for every camera in the given step.
+
+    The frame rate of analyses that only run after motion is not checked.
+    """
+    for rates in result["sources"].values():
+        for name in names:
+            analysis = analyses[name]
+            lag = rates[name]["lag_p95"]
+            if lag is None or lag > max_lag:
+                return False
+            fps = analysis.fps
+            if fps is not None and analysis.get_gate_cells is None and rates[name]["fps"] < FPS_TOLERANCE * fps:
+                return False
+    return True
+
+
+def _publish(video: Path, server: str, index: int):
+    """Start publishing the given video in a loop, as a stream of the given RTSP server."""
+    url = f"{server.rstrip('/')}/load_{index}"
+    command = [
+        "ffmpeg",
+        *("-hide_banner", "-loglevel", "error", "-re", "-stream_loop", "-1"),
+        *("-i", str(video), "-c", "copy", "-f", "rtsp", "-rtsp_transport", "tcp", url),
+    ]
+    return url, subprocess.Popen(command)  # noqa: S603
+
+
+@app.command()
+def run(  # noqa: PLR0913 all parameters are options of the command
+    video: Annotated[Path, Argument(help="Video file to publish for every simulated camera (H.264).")],
+    server: Annotated[str, Option(help="URL of the RTSP server to publish the streams to.")] = "rtsp://127.0.0.1:8554",
+    combinations: Annotated[
+        Optional[list[str]],
+        Option(
+            "--analyses",
+            help="Comma separated analyses to run together. Can be given multiple times. "
+            "By default every analysis on its own and all of them together.",
+        ),
+    ] = None,
+    start: Annotated[int, Option(help="Amount of cameras of the first step.")] = 1,
+    step: Annotated[int, Option(help="Amount of cameras to add with every step.")] = 1,
+    maximum: Annotated[int, Option("--max", help="Highest amount of cameras.")] = 32,
+    warmup: Annotated[float, Option(help="How long to run every step before measuring (in seconds).")] = 30,
+    duration: Annotated[float, Option(help="How long to measure every step (in seconds).")] = 60,
+    max_lag: Annotated[float, Option(help="Highest sustainable lag of results (95th percentile, in seconds).")] = 3,
+    output: Annotated[Optional[Path], Option(help="JSON file to write the results to. Printed if not given.")] = None,
+):
+    """Run the analyses for more and more simulated cameras, until it is not sustainable anymore."""
+    if combinations is None:
+        combinations = [*analyses, ",".join(analyses)]
+    capture = cv2.VideoCapture(str(video))
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)))
+    capture.release()
+    cores = os.cpu_count() or 1
+    publishers: list[tuple[str, subprocess.Popen[bytes]]] = []
+    report: dict[str, Any] = {"cpu_count": cores, "video": str(video), "combinations": []}
+    table = Table("Analyses", "Cameras", "Cameras per core", "CPU cores per camera")
+    # Spawn the steps, so every one starts without the state of the previous one
+    context = get_context("spawn")
+    try:
+        for combination in combinations:
+            names = combination.split(",")
+            steps: list[dict[str, Any]] = []
+            sustainable, per_camera = 0, None
+            for count in range(start, maximum + 1, step):
+                if len(publishers) < count:
+                    publishers.extend(_publish(video, server, index) for index in range(len(publishers), count))
+                    loop.run_until_complete(sleep(PUBLISH_DELAY))
+                sources = {f"load_{index}": url for index, (url, _) in enumerate(publishers[:count])}
+                output_connection, input_connection = Pipe(duplex=False)
+                process = context.Process(
+                    target=_run_step,
+                    args=(sources, names, size, warmup, duration, input_connection),
+                )
+                process.start()
+                input_connection.close()
+                result = output_connection.recv() if output_connection.poll(warmup + duration * 2 + 60) else None
+                process.join()
+                if result is None:
+                    console.print(f"Step with {count} cameras did not finish.")
+                    break
+                result["cameras"] = count
+                result["sustainable"] = _is_sustainable(result, names, max_lag)
+                steps.append(result)
+                console.print(
+                    f"{combination}: {count} cameras, {result['cpu_cores']:.2f} cores, "
+                    f"{result['rss_bytes'] / 1024**2:.0f} MiB, sustainable: {result['sustainable']}",
+                )
+                if not result["sustainable"]:
+                    break
+                sustainable, per_camera = count, result["cpu_cores"] / count
+            report["combinations"].append(
+                {
+                    "analyses": names,
+                    "max_cameras": sustainable,
+                    "cameras_per_core": sustainable / cores,
+                    "cores_per_camera": per_camera,
+                    "steps": steps,
+                },
+            )
+            table.add_row(
+                combination,
+                str(sustainable),
+                f"{sustainable / cores:.2f}",
+                f"{per_camera:.3f}" if per_camera is not None else "-",
+            )
+    finally:
+        for _, publisher in publishers:
+            publisher.terminate()
+            publisher.wait()
+    console.print(table)
+    if output is None:
+        rich.print_json(json.dumps(report))
+    else:
+        output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,57 @@
+"""Module for measuring the per frame cost of reducing a difference image to a segment matrix.
+
+This compares the former cell by cell loop with the single-pass reduction of `_get_changes`.
+Frame sizes that are not divisible by the grid size are included.
+The former loop ignored the pixels at the right and bottom edge that do not fill a whole cell,
+so it is only compared on the other pixels. A change in only these pixels must be in the last row or column.
+"""
+from __future__ import annotations
+
+from timeit import timeit
+
+import numpy as np
+import rich
+
+from analysis.definitions import GRID_SIZE
+from analysis.vision.motion_search.motion import _get_changes  # pyright: ignore[reportPrivateUsage]
+
+SIZES = [(360, 640), (480, 854), (720, 1280), (1080, 1920)]
+RUNS = 200
+DENSITY = 0.001
+"""Share of changed pixels in every generated difference image."""
+
+
+def _get_changes_legacy(diff: np.ndarray, grid_size: tuple[int, int]):
+    """Copy of the former implementation, for comparison."""
+    height, width = diff.shape
+    cell_height = height // grid_size[0]
+    cell_width = width // grid_size[1]
+    boolean_matrix = np.zeros(grid_size, dtype=bool)
+    for y in range(grid_size[0]):
+        for x in range(grid_size[1]):
+            cell = diff[y * cell_height : (y + 1) * cell_height, x * cell_width : (x + 1) * cell_width]
+            if has_values := np.any(cell != 0):
+                boolean_matrix[y, x] = has_values
+    return boolean_matrix
+
+
+rng = np.random.default_rng(0)
+for size in SIZES:
+    # Sparse thresholded difference image, like it is produced for a frame with little motion
+    diff = np.where(rng.random(size) < DENSITY, 255, 0).astype(np.uint8)
+    cropped = np.zeros_like(diff)
+    height, width = size[0] // GRID_SIZE[0] * GRID_SIZE[0], size[1] // GRID_SIZE[1] * GRID_SIZE[1]
+    cropped[:height, :width] = diff[:height, :width]
+    assert (_get_changes(cropped, GRID_SIZE) == _get_changes_legacy(cropped, GRID_SIZE)).all()  # noqa: S101
+    if height < size[0] and width < size[1]:
+        edge = np.zeros(size, dtype=np.uint8)
+        edge[-1, -1] = 255
+        expected = np.zeros(GRID_SIZE, dtype=np.bool_)
+        expected[-1, -1] = True
+        assert (_get_changes(edge, GRID_SIZE) == expected).all(), "Change at the edge was missed."  # noqa: S101
+    legacy = timeit(lambda: _get_changes_legacy(diff, GRID_SIZE), number=RUNS) / RUNS  # noqa: B023
+    reduced = timeit(lambda: _get_changes(diff, GRID_SIZE), number=RUNS) / RUNS  # noqa: B023
+    rich.print(
+        f"{size[1]}x{size[0]}: loop {legacy * 1000:.3f}ms, reduction {reduced * 1000:.3f}ms "
+        f"({legacy / reduced:.1f}x faster)",
+    )
@@ -27,6 +27,6 @@ def _analyze_image(images: tuple[MatLike, MatLike]):
 
 from_capture(VideoCapture(0), Event()).pipe(
     ops.throttle_first(2),
-    ops.map(lambda image: cvtColor(image, COLOR_BGR2GRAY)),
+    ops.map(lambda frame: cvtColor(frame.image, COLOR_BGR2GRAY)),
     ops.pairwise(),
 ).subscribe(_analyze_image, logger.exception)
@@ -0,0 +1,95 @@
+"""Module for measuring the throughput of the motion search ingestion.
+
+This compares the former ingestion (one scalar `lil_array` assignment per cell) with the motion store,
+once with a single segment matrix per call and once with batches of segment matrices.
+Everything runs on a single thread, so the results are change matrices per second per core.
+
+The shards of all cameras are created before measuring, as that happens once per camera and day.
+The store should not be slower than `lil_array` for single matrices, check this after changing the ingestion.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+import rich
+from scipy.sparse import lil_array
+
+from analysis import definitions, state
+from analysis.vision.motion_search.motion import update_global_matrices, update_global_matrix
+from analysis.vision.motion_search.store import MotionStore
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
+MATRIX_COUNT = 5_000
+CAMERA_COUNT = 100
+BATCH_SIZE = 500
+DENSITY = 0.1
+"""Share of cells with motion in every generated segment matrix."""
+
+rng = np.random.default_rng(0)
+matrices = rng.random((MATRIX_COUNT, *definitions.GRID_SIZE)) < DENSITY
+camera_ids = [f"camera_{index % CAMERA_COUNT}" for index in range(MATRIX_COUNT)]
+
+
+def _update_global_matrix_legacy(
+    motions: dict[str, dict[str, lil_array]],
+    change_matrix: NDArray[np.bool_],
+    camera_id: str,
+):
+    """Copy of the former ingestion implementation, for comparison."""
+    non_zero = change_matrix.nonzero()
+    for index, y in enumerate(non_zero[0]):
+        x = non_zero[1][index]
+        index_cell = y * definitions.GRID_SIZE[1] + x
+        time = datetime.now(definitions.TIMEZONE)
+        index_time = int((time - time.replace(hour=0, minute=0, second=0, microsecond=0)).seconds)
+        id_day = str(datetime.now(definitions.TIMEZONE).date())
+        day = motions.setdefault(id_day, {})
+        if camera_id not in day:
+            day[camera_id] = lil_array((definitions.CELLS, definitions.TIMEFRAMES), dtype=bool)
+        day[camera_id][index_cell, index_time] = True
+
+
+def _measure(name: str, run: Callable[[], None]):
+    start = perf_counter()
+    run()
+    duration = perf_counter() - start
+    rich.print(f"{name}: {MATRIX_COUNT / duration:.0f} change matrices/s ({duration:.3f}s)")
+
+
+def _legacy():
+    motions: dict[str, dict[str, lil_array]] = {}
+    for change_matrix, camera_id in zip(matrices, camera_ids, strict=True):
+        _update_global_matrix_legacy(motions, change_matrix, camera_id)
+
+
+def _single():
+    for change_matrix, camera_id in zip(matrices, camera_ids, strict=True):
+        update_global_matrix(change_matrix, camera_id)
+
+
+def _batched():
+    start = datetime.now(definitions.TIMEZONE)
+    changes = [
+        (change_matrix, camera_id, start + timedelta(seconds=index // CAMERA_COUNT))
+        for index, (change_matrix, camera_id) in enumerate(zip(matrices, camera_ids, strict=True))
+    ]
+    for index in range(0, MATRIX_COUNT, BATCH_SIZE):
+        update_global_matrices(changes[index : index + BATCH_SIZE])
+
+
+with TemporaryDirectory() as directory:
+    _measure("lil_array (before)", _legacy)
+    for name, run in (("store, single matrices", _single), (f"store, batches of {BATCH_SIZE}", _batched)):
+        state.motions = MotionStore(Path(directory) / name)
+        state.motions.recover()
+        now = datetime.now(definitions.TIMEZONE)
+        update_global_matrices([(matrices[0], camera_id, now) for camera_id in camera_ids[:CAMERA_COUNT]])
+        _measure(name, run)
+        state.motions.close()
@@ -0,0 +1,66 @@
+"""Module for checking that motion survives a failed checkpoint of the motion store, followed by a crash.
+
+The first checkpoint fails while flushing. During the next checkpoint, the process "crashes" right after the
+rotation of the write-ahead log: Only the log files are copied into a new store, which is then recovered from them.
+"""
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+import rich
+
+from analysis.vision.motion_search.store import FILE_NAME_WAL, MotionStore
+from analysis.vision.motion_search.wal import SUFFIX_ROTATED
+
+DAY_ID = "2024-01-01"
+CAMERA_ID = "camera"
+FIRST = (np.array([3, 4]), np.array([100, 100]))
+"""Cells and time frames that are saved before the failed checkpoint."""
+SECOND = (np.array([7]), np.array([200]))
+"""Cells and time frames that are saved after the failed checkpoint."""
+
+
+with TemporaryDirectory() as directory:
+    path, path_crashed = Path(directory) / "motions", Path(directory) / "crashed"
+
+    def _crash():
+        """Keep only the log files, as if the process crashed before the shards were flushed."""
+        path_crashed.mkdir()
+        for name in (FILE_NAME_WAL, FILE_NAME_WAL + SUFFIX_ROTATED):
+            if (path / name).exists():
+                shutil.copy(path / name, path_crashed / name)
+        raise OSError("Simulated crash.")
+
+    motions = MotionStore(path)
+    # Checkpoints are only triggered by this script
+    motions.recover(checkpoint_interval=3600)
+    motions.set(DAY_ID, CAMERA_ID, *FIRST)
+    # The mapped files of the shards are flushed during checkpoints
+    with patch.object(np.memmap, "flush", side_effect=OSError("Simulated failure of the flush.")):
+        try:
+            motions.checkpoint()
+        except OSError:
+            rich.print("First checkpoint failed.")
+    motions.set(DAY_ID, CAMERA_ID, *SECOND)
+    with patch.object(np.memmap, "flush", side_effect=_crash):
+        try:
+            motions.checkpoint()
+        except OSError:
+            rich.print("Crashed during the second checkpoint.")
+    motions.close()
+
+    recovered = MotionStore(path_crashed)
+    recovered.recover(checkpoint_interval=3600)
+    for cells, index_times in (FIRST, SECOND):
+        column = recovered.get_in_area(DAY_ID, CAMERA_ID, (0, 0, 16, 9))
+        assert column is not None  # noqa: S101
+        assert column[index_times].all(), "Motion was lost."  # noqa: S101
+        counts = recovered.count(DAY_ID, CAMERA_ID)
+        assert counts is not None  # noqa: S101
+        assert (counts[cells] > 0).all(), "Motion was lost."  # noqa: S101
+    recovered.close()
+    rich.print("All motion was recovered from the write-ahead log.")